@@ -0,0 +1,202 @@
+'''
+
+This runs a pool of Uniped environments in worker processes behind asyncio
+coroutines, so a single event loop can drive many environments at once
+
+'''
+
+import asyncio
+import multiprocessing
+
+import uniped
+
+# =====
+# Worker process
+# =====
+
+# Hosts a slice of the pool's environments and serves requests until closed.
+# Replies are (request id, ok, result or error message).
+def worker(conn, morphology, num_envs, env_kwargs):
+    envs = [
+        uniped.make(morphology, render_window=False, **env_kwargs)
+        for _ in range(num_envs)
+    ]
+    try:
+        while True:
+            command, request_id, env_idx, data = conn.recv()
+            if command == 'close':
+                break
+            try:
+                if command == 'reset':
+                    result = envs[env_idx]._reset()
+                elif command == 'step':
+                    result = envs[env_idx]._step(data)
+                else:
+                    raise ValueError('Unsupported command ' + str(command))
+                conn.send((request_id, True, result))
+            except Exception as e:
+                conn.send((request_id, False, repr(e)))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for env in envs:
+            env._close()
+        conn.close()
+
+# =====
+# Asyncio front-end
+# =====
+
+# Handle on one environment of the pool. Only one request per environment
+# should be in flight at a time (await the previous step before the next).
+class AsyncEnv():
+
+    def __init__(self, pool, worker_idx, env_idx):
+        self.pool = pool
+        self.worker_idx = worker_idx
+        self.env_idx = env_idx
+
+    async def reset(self):
+        return await self.pool.request(self.worker_idx, 'reset', self.env_idx)
+
+    async def step(self, action):
+        return await self.pool.request(self.worker_idx, 'step', self.env_idx, action)
+
+class AsyncUniped():
+
+    # Worker processes and their pipes
+    processes = None
+    conns = None
+
+    # Environment handles (env i lives on worker i % num_workers)
+    envs = None
+
+    # In-flight requests, per worker: request id -> future
+    pending = None
+    next_id = 0
+    loop = None
+
+    def __init__(self, morphology, num_envs, num_workers=None, context=None, **env_kwargs):
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        num_workers = max(1, min(num_envs, num_workers))
+        ctx = multiprocessing.get_context(context)
+
+        self.processes = []
+        self.conns = []
+        self.pending = []
+        for worker_idx in range(num_workers):
+            envs_on_worker = len(range(worker_idx, num_envs, num_workers))
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=worker,
+                args=(child_conn, morphology, envs_on_worker, env_kwargs),
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self.processes.append(process)
+            self.conns.append(parent_conn)
+            self.pending.append({})
+
+        self.envs = [
+            AsyncEnv(self, i % num_workers, i // num_workers)
+            for i in range(num_envs)
+        ]
+
+    def __len__(self):
+        return len(self.envs)
+
+    def __getitem__(self, idx):
+        return self.envs[idx]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    # ===== Requests =====
+
+    def attach(self):
+        # Watch worker pipes from the running event loop
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        if self.loop is not None:
+            raise RuntimeError('AsyncUniped error: pool is already attached to another event loop')
+        for worker_idx, conn in enumerate(self.conns):
+            loop.add_reader(conn.fileno(), self.receive, worker_idx)
+        self.loop = loop
+
+    async def request(self, worker_idx, command, env_idx, data=None):
+        self.attach()
+        if self.conns[worker_idx].closed:
+            raise RuntimeError('AsyncUniped error: worker ' + str(worker_idx) + ' is not running')
+        request_id = self.next_id
+        self.next_id += 1
+        future = self.loop.create_future()
+        self.pending[worker_idx][request_id] = future
+        try:
+            self.conns[worker_idx].send((command, request_id, env_idx, data))
+        except OSError as e:
+            del self.pending[worker_idx][request_id]
+            raise RuntimeError('AsyncUniped error: worker ' + str(worker_idx) + ' is not running') from e
+        return await future
+
+    def receive(self, worker_idx):
+        conn = self.conns[worker_idx]
+        pending = self.pending[worker_idx]
+        try:
+            while conn.poll():
+                request_id, ok, result = conn.recv()
+                future = pending.pop(request_id)
+                if future.cancelled():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(result))
+        except (EOFError, OSError):
+            # Worker died: fail everything it still owed us
+            self.loop.remove_reader(conn.fileno())
+            conn.close()
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError('AsyncUniped error: worker ' + str(worker_idx) + ' exited')
+                    )
+            pending.clear()
+
+    # ===== Whole-pool helpers =====
+
+    async def reset_all(self):
+        return await asyncio.gather(*[env.reset() for env in self.envs])
+
+    async def step_all(self, actions):
+        return await asyncio.gather(*[
+            env.step(action) for env, action in zip(self.envs, actions)
+        ])
+
+    def close(self):
+        for conn in self.conns:
+            if conn.closed:
+                continue
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.remove_reader(conn.fileno())
+            try:
+                conn.send(('close', None, None, None))
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        # Nothing will answer requests still in flight
+        for pending in self.pending:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(RuntimeError('AsyncUniped error: pool was closed'))
+            pending.clear()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.loop = None
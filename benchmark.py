@@ -0,0 +1,165 @@
+'''
+
+Small benchmarks for the simulation (run with `python3 benchmark.py <name>`)
+
+'''
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# =====
+# Worker startup
+# =====
+
+# Runs in a fresh interpreter: import, build a headless env and step it once.
+# With eager=True it also does what Engine used to do on import/construction
+# (import pygame, pygame.init(), load the font) for comparison.
+STARTUP_SNIPPET = '''
+import json, sys, time
+t0 = time.perf_counter()
+if %(eager)s:
+    import pygame
+    import pygame.font
+    pygame.init()
+    pygame.font.init()
+    pygame.time.Clock()
+    pygame.font.SysFont('arial', 16)
+import uniped
+import %(morphology)s as morphology
+t1 = time.perf_counter()
+env = uniped.Uniped(
+    morphology.objects, morphology.joints,
+    morphology.key_events, morphology.control_events,
+    'body', False
+)
+env._step(None)
+t2 = time.perf_counter()
+print(json.dumps({
+    'import': t1 - t0,
+    'construct': t2 - t1,
+    'pygame_loaded': 'pygame' in sys.modules
+}))
+'''
+
+def run_startup(morphology, eager):
+    code = STARTUP_SNIPPET % {'eager': eager, 'morphology': morphology}
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        check=True
+    ).stdout
+    total = time.perf_counter() - start
+    result = json.loads(out.decode().strip().splitlines()[-1])
+    result['total'] = total
+    return result
+
+def bench_startup(args):
+    for eager in (True, False):
+        runs = [run_startup(args.morphology, eager) for _ in range(args.repeat)]
+        print('%-6s total %.3fs  import %.3fs  construct+step %.3fs  pygame loaded: %s' % (
+            'eager' if eager else 'lazy',
+            statistics.median(r['total'] for r in runs),
+            statistics.median(r['import'] for r in runs),
+            statistics.median(r['construct'] for r in runs),
+            runs[0]['pygame_loaded']
+        ))
+
+# =====
+# Contacts and collision filtering
+# =====
+
+# What Engine.add_object used to do: category on the first fixture only and
+# default mask/group, so every part touches every other part and the ground
+def apply_legacy_filtering(env):
+    import Box2D.b2 as b2
+
+    for name in env.body_names:
+        for i, fixture in enumerate(env.eng.bodies[name].fixtures):
+            category = fixture.filterData.categoryBits if i == 0 else 0x00
+            fixture.filterData = b2.filter(categoryBits=category, maskBits=0xFFFF, groupIndex=0)
+
+def run_contacts(morphology, legacy, episodes, max_ticks, seed):
+    import numpy as np
+    import uniped
+
+    env = uniped.make(morphology, render_window=False)
+    rng = np.random.RandomState(seed)
+    num_actions = min(len(env.actions), 8)
+    ticks = contacts = touching = tail_contacts = 0
+    step_time = world_time = 0.0
+    for _ in range(episodes):
+        env._reset()
+        if legacy:
+            apply_legacy_filtering(env)
+        for _ in range(max_ticks):
+            action = rng.randint(num_actions)
+            start = time.perf_counter()
+            env.eng.handle_controls(env.key_events, env._get_controls(action), env)
+            world_start = time.perf_counter()
+            env.eng.step()
+            world_time += time.perf_counter() - world_start
+            done = env._observe()[2]
+            step_time += time.perf_counter() - start
+
+            ticks += 1
+            for contact in env.eng.world.contacts:
+                contacts += 1
+                touching += contact.touching
+                names = (contact.fixtureA.body.userData['name'], contact.fixtureB.body.userData['name'])
+                if names[0].startswith('tail') or names[1].startswith('tail'):
+                    tail_contacts += 1
+            if done:
+                break
+    env._close()
+    return {
+        'ticks': ticks,
+        'contacts': contacts / ticks,
+        'touching': touching / ticks,
+        'tail_contacts': tail_contacts / ticks,
+        'world_step_us': 1e6 * world_time / ticks,
+        'env_step_us': 1e6 * step_time / ticks
+    }
+
+# before: the old filtering, after: the spec's masks (same physics), lean:
+# the opt-in lean masks (different physics, so different episodes)
+def bench_contacts(args):
+    morphologies = [args.morphology] if args.morphology != 'all' else ['kangaroo', 'pogo']
+    for morphology in morphologies:
+        for label, variant, legacy in (('before', morphology, True), ('after', morphology, False),
+                                       ('lean', morphology + ':lean', False)):
+            result = run_contacts(variant, legacy, args.repeat, args.max_ticks, args.seed)
+            print('%-8s %-6s contacts/tick %6.2f  touching %6.2f  tail %6.2f  world.Step %6.1fus  env step %6.1fus  (%d ticks)' % (
+                morphology,
+                label,
+                result['contacts'],
+                result['touching'],
+                result['tail_contacts'],
+                result['world_step_us'],
+                result['env_step_us'],
+                result['ticks']
+            ))
+
+# =====
+# Command line
+# =====
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'contacts': bench_contacts
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Robo QWOP benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--morphology', default='kangaroo')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs (startup) or episodes (contacts)')
+    parser.add_argument('--max-ticks', type=int, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,85 @@
+'''
+
+This accumulates per-episode gait statistics of a Uniped: foot strikes,
+flight phases, airtime, highest point and distance. The counters are updated
+every step from a handful of Box2D reads and reported once, as a summary, in
+the info of the step that ends the episode.
+
+'''
+
+import engine
+
+# Whether body is touching the ground right now (unlike the hit_ground flag
+# the contact listener sets, which stays set for the rest of the episode)
+def touching_ground(body):
+    for edge in body.contacts:
+        if edge.contact.touching and edge.other.userData['name'] == 'ground':
+            return True
+    return False
+
+class EpisodeStats():
+
+    # Counters of the current episode
+    steps = 0
+    total_reward = 0.0
+    foot_strikes = 0 # landings (foot touches down after being in the air)
+    flight_phases = 0 # takeoffs (foot leaves the ground)
+    air_steps = 0 # steps with the foot off the ground
+    ground_steps = 0 # steps with the foot on the ground
+    max_height = None # highest the body got once the foot first landed (Box2D y)
+    foot_down = False
+    landed = False
+
+    def reset(self, env):
+        self.steps = 0
+        self.total_reward = 0.0
+        self.foot_strikes = 0
+        self.flight_phases = 0
+        self.air_steps = 0
+        self.ground_steps = 0
+        self.max_height = None
+        foot = env.eng.bodies.get(env.prefix + 'foot')
+        self.foot_down = foot is not None and touching_ground(foot)
+        self.landed = self.foot_down
+
+    # Count the step env just took
+    def update(self, env):
+        bodies = env.eng.bodies
+        self.steps += 1
+
+        foot = bodies.get(env.prefix + 'foot')
+        foot_down = foot is not None and touching_ground(foot)
+        if foot_down and not self.foot_down:
+            self.foot_strikes += 1
+        elif self.foot_down and not foot_down:
+            self.flight_phases += 1
+        self.foot_down = foot_down
+        self.landed = self.landed or foot_down
+
+        # Not counting the drop from the spawn point
+        if self.landed:
+            if foot_down:
+                self.ground_steps += 1
+            else:
+                self.air_steps += 1
+            height = bodies[env.prefix + 'body'].position[1]
+            if self.max_height is None or height > self.max_height:
+                self.max_height = height
+
+    def add_reward(self, reward):
+        self.total_reward += reward
+
+    def summary(self, env):
+        airtime = self.air_steps * engine.TIME_STEP
+        landed_steps = self.air_steps + self.ground_steps
+        return {
+            'length': self.steps,
+            'return': self.total_reward,
+            'distance': env.eng.bodies[env.prefix + 'body'].position[0] + env.eng.origin_x - env.offset[0],
+            'max_height': self.max_height,
+            'foot_strikes': self.foot_strikes,
+            'flight_phases': self.flight_phases,
+            'airtime': airtime,
+            'airtime_fraction': self.air_steps / landed_steps if landed_steps else 0.0,
+            'mean_flight_time': airtime / self.flight_phases if self.flight_phases else 0.0
+        }
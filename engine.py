@@ -6,11 +6,14 @@ This runs the box2d engine with pygame visualizations
 
 import Box2D
 import Box2D.b2 as b2
-import pygame
-import pygame.font
-import pygame.gfxdraw
 import sys
 
+# pygame and numpy are imported on first use (see load_pygame/load_numpy) so
+# that headless training workers never pay for them here; numpy is only needed
+# to render
+pygame = None
+np = None
+
 # =====
 # Globals
 # =====
@@ -18,50 +21,224 @@ import sys
 PPM = 30.0 # Pixels per meter
 TARGET_FPS = 60
 TIME_STEP = 1.0 / TARGET_FPS
+DISPLAY_FPS = 60 # frame rate of human play, interpolated between ticks
 SCREEN_WIDTH, SCREEN_HEIGHT = 1000, 800
 GROUND_WIDTH = 300
 GROUND_START = GROUND_WIDTH - 40
 
+# Collision category of the ground
+GROUND_CATEGORY = 0x01
+
 # ======
 # Accessory functions
 # =====
 
-def usim_draw_poly(polygon, body, fixture, screen, camera_x=0, camera_y=0):
-    vertices = [(body.transform * v) * PPM for v in polygon.vertices]
-    vertices = [(v[0] - camera_x, SCREEN_HEIGHT - v[1] - camera_y) for v in vertices]
-    pygame.draw.polygon(screen, body.color, vertices)
-
-    if body.userData['name'] == 'ground':
-        # Texture ground
-        try:
-            grass = pygame.image.load('grass.jpg').convert()
-            pygame.gfxdraw.textured_polygon(
-                screen, vertices, grass, int(-camera_x), int(-camera_y)
-            )
-        except:
-            pass
-b2.polygonShape.draw = usim_draw_poly
-
-def usim_draw_circle(circle, body, fixture, screen, camera_x=0, camera_y=0):
-    position = body.transform * circle.pos * PPM
-    position = (position[0] - camera_x, SCREEN_HEIGHT - position[1] - camera_y)
-    pygame.draw.circle(
-        screen, body.color,
-        [int(x) for x in position],
-        int(circle.radius * PPM)
-    )
-b2.circleShape.draw = usim_draw_circle
-
-def convert_coords_world2disp(point, camera_x=0, camera_y=0):
-    point = [v * PPM for v in point]
-    point = [point[0] - camera_x, SCREEN_HEIGHT - point[1] - camera_y]
+def load_pygame():
+    global pygame
+    if pygame is None:
+        import pygame
+        import pygame.font
+        import pygame.gfxdraw
+    return pygame
+
+def load_numpy():
+    global np
+    if np is None:
+        import numpy as np
+    return np
+
+def key_code(value):
+    # Key events may name pygame constants ('KEYDOWN', 'K_q') so that
+    # morphology modules do not have to import pygame themselves
+    if isinstance(value, str):
+        return getattr(load_pygame(), value)
+    return value
+
+def convert_coords_world2disp(point, camera_x=0, camera_y=0, ppm=PPM, height=SCREEN_HEIGHT):
+    point = [v * ppm for v in point]
+    point = [point[0] - camera_x, height - point[1] - camera_y]
     return point
 
+# World points (N, 2) to display points, all at once
+def convert_coords_world2disp_batch(points, camera_x=0, camera_y=0, ppm=PPM, height=SCREEN_HEIGHT):
+    load_numpy()
+    disp = np.empty_like(points)
+    disp[:, 0] = points[:, 0] * ppm - camera_x
+    disp[:, 1] = height - points[:, 1] * ppm - camera_y
+    return disp
+
 def convert_coords_disp2world(point):
     point = [point[0], SCREEN_HEIGHT - point[1]]
     point = [int(v / PPM) for v in point]
     return point
 
+# =====
+# Name-keyed registry of bodies and joints
+# =====
+
+# Dict-like store backed by index-based slots. Assigning None to a name (which
+# is how destroyed bodies/joints are dropped, see Engine.reset or the control
+# functions) only marks its slot dead and records it in the dirty set, so
+# compact() does nothing unless something was actually destroyed.
+class Registry():
+
+    # Bumped whenever an entry is added, replaced or dropped, so holders of
+    # resolved handles know to look them up again
+    version = 0
+
+    def __init__(self):
+        self.names = []
+        self.items = []
+        self.index = {}
+        self.dirty = set()
+        self.version = 0
+
+    def __getitem__(self, name):
+        return self.items[self.index[name]]
+
+    def __setitem__(self, name, item):
+        slot = self.index.get(name)
+        self.version += 1
+        if slot is None:
+            if item is not None:
+                self.index[name] = len(self.items)
+                self.names.append(name)
+                self.items.append(item)
+        else:
+            self.items[slot] = item
+            if item is None:
+                self.dirty.add(slot)
+            else:
+                self.dirty.discard(slot)
+
+    def __contains__(self, name):
+        slot = self.index.get(name)
+        return slot is not None and self.items[slot] is not None
+
+    def __iter__(self):
+        # Iterate by slot so entries can be set to None while iterating
+        names = self.names
+        items = self.items
+        for slot in range(len(items)):
+            if items[slot] is not None:
+                yield names[slot]
+
+    def __len__(self):
+        return len(self.items) - len(self.dirty)
+
+    def get(self, name, default=None):
+        slot = self.index.get(name)
+        if slot is None or self.items[slot] is None:
+            return default
+        return self.items[slot]
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [item for item in self.items if item is not None]
+
+    def compact(self):
+        # Drop dead slots; no-op in the steady state
+        if not self.dirty:
+            return
+        live = [slot for slot in range(len(self.items)) if slot not in self.dirty]
+        self.names = [self.names[slot] for slot in live]
+        self.items = [self.items[slot] for slot in live]
+        self.index = {name: slot for slot, name in enumerate(self.names)}
+        self.dirty.clear()
+
+# =====
+# Batched rendering
+# =====
+
+# Local geometry of every fixture of the world's bodies, flattened into one
+# vertex array so that a frame transforms all of them in one NumPy pass.
+# Rebuilt only when bodies come and go (see Registry.version).
+class RenderCache():
+
+    version = None
+    bodies = None
+    index = None # body -> index into bodies
+    local = None # (V, 2) local vertices (a circle's center is one vertex)
+    vertex_body = None # (V,) index into bodies of each vertex
+    # Draw calls in order: ('poly', start, end, body) or ('circle', start,
+    # radius, body), start/end into the vertex array
+    items = None
+
+    # Body positions and angles at the previous physics tick (see
+    # Engine.interpolate), or None
+    previous = None
+
+    def build(self, registry):
+        load_numpy()
+        old_index, old_previous = self.index, self.previous
+        self.bodies = []
+        self.index = {}
+        local, vertex_body = [], []
+        self.items = []
+        for name in registry:
+            body = registry[name]
+            index = len(self.bodies)
+            self.bodies.append(body)
+            self.index[body] = index
+            for fixture in body.fixtures:
+                shape = fixture.shape
+                start = len(local)
+                if isinstance(shape, b2.polygonShape):
+                    local += shape.vertices
+                    self.items.append(('poly', start, len(local), body))
+                elif isinstance(shape, b2.circleShape):
+                    local.append(tuple(shape.pos))
+                    self.items.append(('circle', start, shape.radius, body))
+                else:
+                    continue
+                vertex_body += [index] * (len(local) - start)
+        self.local = np.array(local, dtype=np.float64).reshape(-1, 2)
+        self.vertex_body = np.array(vertex_body, dtype=np.intp)
+        self.version = registry.version
+
+        # Bodies that are still around keep their previous pose (new ones
+        # start without motion)
+        self.previous = None
+        if old_previous is not None:
+            positions, angles = self.read()
+            for body, index in self.index.items():
+                old = old_index.get(body)
+                if old is not None:
+                    positions[index] = old_previous[0][old]
+                    angles[index] = old_previous[1][old]
+            self.previous = positions, angles
+
+    def read(self):
+        bodies = self.bodies
+        positions = np.array([body.position for body in bodies], dtype=np.float64).reshape(-1, 2)
+        angles = np.array([body.angle for body in bodies], dtype=np.float64)
+        return positions, angles
+
+    def save_previous(self):
+        self.previous = self.read()
+
+    # Body positions and angles alpha of the way from the previous tick to
+    # the current one
+    def pose(self, alpha=1.0):
+        positions, angles = self.read()
+        if alpha < 1.0 and self.previous is not None:
+            previous_positions, previous_angles = self.previous
+            positions = previous_positions + alpha * (positions - previous_positions)
+            angles = previous_angles + alpha * (angles - previous_angles)
+        return positions, angles
+
+    # World coordinates of points given in the frames of bodies owners
+    def transform(self, positions, angles, local, owners):
+        cos = np.cos(angles)[owners]
+        sin = np.sin(angles)[owners]
+        x, y = local[:, 0], local[:, 1]
+        world = positions[owners]
+        world[:, 0] += cos * x - sin * y
+        world[:, 1] += sin * x + cos * y
+        return world
+
 # =====
 # Basically the engine object
 # =====
@@ -80,7 +257,8 @@ class Engine():
     screen = None
     width = SCREEN_WIDTH
     height = SCREEN_HEIGHT
-    clock = pygame.time.Clock()
+    clock = None
+    pygame_ready = False
 
     # Render destination
     render_window = True # Show rendering in a window
@@ -89,19 +267,42 @@ class Engine():
 
     # Decorations
     font = None
+    font_name = 'arial'
+    font_size = 16
+    grass = None # ground texture, loaded once (False = not available)
+    render_cache = None
+
+    # Interpolated rendering: with interpolate on, every tick keeps the pose
+    # it started from and frames are drawn render_alpha of the way from that
+    # pose to the current one (see uniped.play), so the display can run
+    # smoothly at a higher rate than the physics
+    interpolate = False
+    render_alpha = 1.0
+
+    # Key event dispatch table (see get_key_table)
+    key_table = None
+    key_table_source = None
 
     # =====
     # World objects and state
     # =====
     num_ticks = 0
-    bodies = {}
-    joints = {}
+    bodies = None
+    joints = None
+
+    # Streamed procedural ground (see terrain.py), None = one flat box
+    terrain = None
+    # World x of the Box2D origin, moved along with the robot (see shift_origin)
+    origin_x = 0.0
+    # Bumped whenever ground geometry changes (terrain chunks, origin shifts)
+    ground_version = 0
 
     def __init__(
         self,
         contactListener=None,
         render_window=True, render_video=False, video_file=None,
-        font='arial', font_size=16
+        font='arial', font_size=16,
+        terrain=None
     ):
         # Initialize rendering destination params
         self.render_window = render_window
@@ -110,6 +311,10 @@ class Engine():
         if self.render_video and video_file is None:
             raise ValueError('Engine error: Specified rendering to video, but did not specify file name')
 
+        # Initialize registries
+        self.bodies = Registry()
+        self.joints = Registry()
+
         # Initialize world
         self.world = b2.world(
             gravity = (0, -50),
@@ -117,21 +322,25 @@ class Engine():
             contactListener = contactListener
         )
 
-        # Create ground
-        self.add_object(
-            'ground',
-            {
-                'position': (GROUND_START, 0)
-            },
-            'poly',
-            {
-                'box': (GROUND_WIDTH, 5),
-                'friction': 0.5
-            },
-            (80, 80, 80, 255),
-            True,
-            0x01
-        )
+        # Create ground (flat, unless terrain chunks are streamed in)
+        self.terrain = terrain
+        if terrain is not None:
+            terrain.stream(self, 0, 0)
+        else:
+            self.add_object(
+                'ground',
+                {
+                    'position': (GROUND_START, 0)
+                },
+                'poly',
+                {
+                    'box': (GROUND_WIDTH, 5),
+                    'friction': 0.5
+                },
+                (80, 80, 80, 255),
+                True,
+                GROUND_CATEGORY
+            )
 
         # Create mouse
         self.add_object(
@@ -143,12 +352,24 @@ class Engine():
             None
         )
 
-        # Initialize pygame modules
-        pygame.init()
-        pygame.font.init()
-
-        # Initialize rendering decorations
-        self.font = pygame.font.SysFont(font, font_size)
+        # Rendering decorations are loaded lazily (see get_font)
+        self.font_name = font
+        self.font_size = font_size
+
+    def init_pygame(self):
+        # Only called once rendering is requested
+        if not self.pygame_ready:
+            load_pygame()
+            pygame.init()
+            self.clock = pygame.time.Clock()
+            self.pygame_ready = True
+
+    def get_font(self):
+        if self.font is None:
+            self.init_pygame()
+            pygame.font.init()
+            self.font = pygame.font.SysFont(self.font_name, self.font_size)
+        return self.font
 
     def reset(self):
         # Remove joints
@@ -158,13 +379,17 @@ class Engine():
                 self.world.DestroyJoint(self.joints[joint_key])
                 self.joints[joint_key] = None
 
-        # Remove objects
+        # Remove objects (the ground and its terrain chunks stay)
         for body_key in self.bodies:
             body = self.bodies[body_key]
-            if body is not None and body_key != 'mouse' and body_key != 'ground':
+            if body is not None and body_key != 'mouse' and body.userData['name'] != 'ground':
                 self.world.DestroyBody(self.bodies[body_key])
                 self.bodies[body_key] = None
 
+        # Move the origin back to the start
+        if self.origin_x != 0:
+            self.shift_origin(-self.origin_x)
+
         # Reset time
         self.num_ticks = 0
 
@@ -172,17 +397,25 @@ class Engine():
         self.cleanup()
 
     def cleanup(self):
-        joint_keys = list(self.joints.keys())
-        for key in joint_keys:
-            if self.joints[key] is None:
-                self.joints.pop(key)
-
-        body_keys = list(self.bodies.keys())
-        for key in body_keys:
-            if self.bodies[key] is None:
-                self.bodies.pop(key)
-
-    def add_object(self, name, obj_args, shape_type, shape_args, color=(50, 50, 50, 100), fixed=False, category=0x00):
+        # Only compacts registries that had something destroyed
+        if self.joints.dirty:
+            self.joints.compact()
+        if self.bodies.dirty:
+            self.bodies.compact()
+
+    # Move the Box2D origin to world x (in current Box2D coordinates), so
+    # everything near it gets small coordinates again
+    def shift_origin(self, x):
+        self.world.ShiftOrigin((x, 0))
+        self.origin_x += x
+        self.ground_version += 1
+        if self.render_cache is not None and self.render_cache.previous is not None:
+            self.render_cache.previous[0][:, 0] -= x
+
+    def add_object(
+        self, name, obj_args, shape_type, shape_args, color=(50, 50, 50, 100), fixed=False,
+        category=0x00, mask=0xFFFF, group=0
+    ):
         # And objects to the world
         if fixed:
             obj = self.world.CreateStaticBody(**obj_args)
@@ -198,8 +431,10 @@ class Engine():
             'name': name
         }
         self.bodies[name] = obj
-        if len(self.bodies[name].fixtures) > 0:
-            self.bodies[name].fixtures[0].filterData.categoryBits = category
+        # Filter every fixture so Box2D never creates contacts the spec rules out
+        collision_filter = b2.filter(categoryBits=category, maskBits=mask, groupIndex=group)
+        for fixture in obj.fixtures:
+            fixture.filterData = collision_filter
 
     def add_joint(self, name, joint_type, obj1_name, obj2_name, joint_args, anchor_offset=None):
         joint = None
@@ -243,25 +478,38 @@ class Engine():
         else:
             raise ValueError('Unsupported joint type ' + joint_type + ' was specified')
 
-    def get_state(self):
+    # State of all bodies/joints, or only the named ones. Names are looked up
+    # with prefix prepended (see Uniped robots sharing a world) and reported
+    # without it.
+    def get_state(self, body_names=None, joint_names=None, prefix=''):
         state = {
             'ticks': self.num_ticks,
             'bodies': {},
             'joints': {}
         }
 
-        for body in self.bodies:
+        if body_names is None:
+            body_names = self.bodies
+        for body in body_names:
+            obj = self.bodies.get(prefix + body)
+            if obj is None:
+                continue
             state['bodies'][body] = {}
-            state['bodies'][body]['position'] = list(self.bodies[body].position)
-            state['bodies'][body]['angle'] = self.bodies[body].angle
-            state['bodies'][body]['lin_vel'] = self.bodies[body].linearVelocity
-            state['bodies'][body]['ang_vel'] = self.bodies[body].angularVelocity
-            state['bodies'][body]['custom_data'] = self.bodies[body].userData
-
-        for joint in self.joints:
+            state['bodies'][body]['position'] = list(obj.position)
+            state['bodies'][body]['angle'] = obj.angle
+            state['bodies'][body]['lin_vel'] = obj.linearVelocity
+            state['bodies'][body]['ang_vel'] = obj.angularVelocity
+            state['bodies'][body]['custom_data'] = obj.userData
+
+        if joint_names is None:
+            joint_names = self.joints
+        for joint in joint_names:
+            obj = self.joints.get(prefix + joint)
+            if obj is None:
+                continue
             state['joints'][joint] = {}
-            if hasattr(self.joints[joint], 'motorSpeed'):
-                state['joints'][joint]['force'] = self.joints[joint].motorSpeed
+            if hasattr(obj, 'motorSpeed'):
+                state['joints'][joint]['force'] = obj.motorSpeed
             else:
                 state['joints'][joint]['force'] = 0
 
@@ -272,7 +520,7 @@ class Engine():
         camera_x = 0
         camera_y = 0
         if obj_to_track in self.bodies and (follow_x or follow_y):
-            position = list(self.bodies[obj_to_track].position)
+            position = self.get_render_position(obj_to_track)
             camera_x, camera_y = convert_coords_world2disp(position)
             camera_x -= 0.5 * SCREEN_WIDTH
             camera_y -= 0.5 * SCREEN_HEIGHT
@@ -290,30 +538,69 @@ class Engine():
     def loop_once(self, key_events=[], controls=[]):
         self.handle_controls(key_events, controls)
         self.render()
+        self.clock.tick(TARGET_FPS)
 
     def handle_controls(self, key_events=[], controls=[], custom_dat=None):
-        # Capture events
-        for event in pygame.event.get():
+        self.handle_events(key_events, custom_dat)
+        self.apply_controls(controls, custom_dat)
+        self.finish_controls()
+
+    def handle_events(self, key_events=[], custom_dat=None):
+        # Capture events (nothing to capture until something was rendered)
+        events = pygame.event.get() if self.pygame_ready else []
+        if events:
+            self.dispatch_events(events, key_events, custom_dat)
+
+    def dispatch_events(self, events, key_events=[], custom_dat=None):
+        table = self.get_key_table(key_events)
+        for event in events:
             if event.type == pygame.QUIT:
                 self.quit()
                 sys.exit()
-            #elif (event.type == pygame.KEYDOWN and event.key == pygame.K_x):
-            #    for joint_key in self.joints:
-            #        world.DestroyJoint(self.joints[joint_key])
-            #        self.joints[joint_key] = None 
-            for key_event in key_events:
-                if event.type == key_event['type']:
-                    if key_event['key'] is None or event.key == key_event['key']:
-                        key_event['fn'](
-                            self,
-                            self.world,
-                            self.bodies,
-                            key_event['body_names'],
-                            self.joints,
-                            key_event['joint_names'],
-                            custom_dat
-                        )
-
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                # Sync mouse body before any drag joint is attached to it
+                self.bodies['mouse'].position = convert_coords_disp2world(event.pos)
+
+            # Handlers for this exact key, and for any key of this type
+            handlers = table.get((event.type, getattr(event, 'key', None)), ())
+            any_key = table.get((event.type, None))
+            if any_key and handlers is not any_key:
+                handlers = sorted(handlers + any_key, key=lambda handler: handler[0])
+            for index, key_event in handlers:
+                key_event['fn'](
+                    self,
+                    self.world,
+                    self.bodies,
+                    key_event['body_names'],
+                    self.joints,
+                    key_event['joint_names'],
+                    custom_dat
+                )
+
+    # key_events as a dispatch table: (event type, key or None) -> [(index,
+    # key_event)], in list order. Built once per key_events list.
+    def get_key_table(self, key_events):
+        if self.key_table_source is not key_events:
+            table = {}
+            for index, key_event in enumerate(key_events):
+                key = key_event['key']
+                code = (key_code(key_event['type']), None if key is None else key_code(key))
+                table.setdefault(code, []).append((index, key_event))
+            self.key_table = table
+            self.key_table_source = key_events
+        return self.key_table
+
+    # Have pygame queue only the events something handles: quitting, the
+    # types used by key_events and any extra types (names or codes)
+    def allow_events(self, key_events=[], extra=()):
+        self.init_pygame()
+        types = {pygame.QUIT, pygame.MOUSEBUTTONDOWN}
+        types.update(key_code(key_event['type']) for key_event in key_events)
+        types.update(key_code(event_type) for event_type in extra)
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(sorted(types))
+
+    def apply_controls(self, controls=[], custom_dat=None):
         # Handle custom controls
         for control in controls:
             control['fn'](
@@ -326,23 +613,23 @@ class Engine():
                 custom_dat
             )
 
+    def finish_controls(self):
         # Cleanup if necessary
         self.cleanup()
 
-        # Update mouse
-        mouse_pos = list(pygame.mouse.get_pos())
-        mouse_pos = convert_coords_disp2world(mouse_pos)
-        self.bodies['mouse'].position = mouse_pos
-
-        # Update bodies attached to mouse
+        # Update mouse and bodies attached to it (only while dragging)
         if 'joint_mouse' in self.joints:
+            mouse_pos = list(pygame.mouse.get_pos())
+            mouse_pos = convert_coords_disp2world(mouse_pos)
+            self.bodies['mouse'].position = mouse_pos
             self.joints['joint_mouse'].bodyA.position = mouse_pos
 
     def step(self):
         # Advance timestep
         self.num_ticks += 1
+        if self.interpolate:
+            self.get_render_cache().save_previous()
         self.world.Step(TIME_STEP, 10, 10)
-        self.clock.tick(TARGET_FPS)
 
     def render(self, obj_to_track='', follow_x=True, follow_y=True, custom_render=[]):
         if not self.render_window and not self.render_video:
@@ -352,6 +639,7 @@ class Engine():
 
         # Define screen if it does not exist yet
         if self.screen is None:
+            self.init_pygame()
             size = self.width, self.height = SCREEN_WIDTH, SCREEN_HEIGHT
             if self.render_window:
                 # Create display
@@ -366,25 +654,7 @@ class Engine():
         self.screen.fill((60, 120, 216))
 
         camera_x, camera_y = self.get_camera_position(obj_to_track, follow_x, follow_y)
-
-        # Render objects
-        for body_key in self.bodies:
-            body = self.bodies[body_key]
-            if body.fixtures is not None:
-                for fixture in body.fixtures:
-                    fixture.shape.draw(
-                        body, fixture, self.screen, camera_x, camera_y
-                    )
-
-        # Render joints
-        for joint_key in self.joints:
-            joint = self.joints[joint_key]
-            if joint is not None:
-                point1 = list(joint.anchorA)
-                point2 = list(joint.anchorB)
-                vert1 = convert_coords_world2disp(point1, camera_x, camera_y)
-                vert2 = convert_coords_world2disp(point2, camera_x, camera_y)
-                pygame.draw.line(self.screen, (200, 100, 80, 100), vert1, vert2, 2)
+        self.draw_world(self.screen, camera_x, camera_y)
 
         # Custom rendering
         for custom in custom_render:
@@ -397,8 +667,99 @@ class Engine():
         if self.render_window:
             pygame.display.flip()
 
+    # Draw the bodies and joints onto surface at ppm pixels per meter, with
+    # camera_x/camera_y in pixels (see get_camera_position). Also used to draw
+    # scaled-down views of several worlds into one frame (see viewer.py).
+    def draw_world(self, surface, camera_x=0, camera_y=0, ppm=PPM, texture=True):
+        height = surface.get_height()
+
+        # Render objects (every vertex transformed in one pass)
+        cache = self.get_render_cache()
+        alpha = self.render_alpha if self.interpolate and cache.previous is not None else 1.0
+        positions, angles = cache.pose(alpha)
+        if len(cache.local):
+            vertices = convert_coords_world2disp_batch(
+                cache.transform(positions, angles, cache.local, cache.vertex_body),
+                camera_x, camera_y, ppm, height
+            ).tolist()
+            grass = self.get_grass() if texture else None
+            for kind, start, end, body in cache.items:
+                if kind == 'poly':
+                    polygon = vertices[start:end]
+                    pygame.draw.polygon(surface, body.color, polygon)
+                    if grass and body.userData['name'] == 'ground':
+                        # Texture ground
+                        pygame.gfxdraw.textured_polygon(
+                            surface, polygon, grass, int(-camera_x), int(-camera_y)
+                        )
+                else:
+                    pygame.draw.circle(
+                        surface, body.color,
+                        [int(x) for x in vertices[start]],
+                        max(1, int(end * ppm))
+                    )
+
+        # Render joints (between ticks, anchors move with their bodies)
+        width = max(1, int(round(2 * ppm / PPM)))
+        anchors, local, owners = [], [], []
+        for joint_key in self.joints:
+            joint = self.joints[joint_key]
+            if joint is None:
+                continue
+            if alpha < 1.0:
+                owner_a = cache.index.get(joint.bodyA)
+                owner_b = cache.index.get(joint.bodyB)
+                if owner_a is not None and owner_b is not None:
+                    local += [tuple(joint.GetLocalAnchorA()), tuple(joint.GetLocalAnchorB())]
+                    owners += [owner_a, owner_b]
+                    continue
+            anchors.append(tuple(joint.anchorA))
+            anchors.append(tuple(joint.anchorB))
+        if local:
+            anchors += cache.transform(
+                positions, angles, np.array(local, dtype=np.float64), np.array(owners, dtype=np.intp)
+            ).tolist()
+        if anchors:
+            anchors = convert_coords_world2disp_batch(
+                np.array(anchors, dtype=np.float64), camera_x, camera_y, ppm, height
+            ).tolist()
+            for k in range(0, len(anchors), 2):
+                pygame.draw.line(surface, (200, 100, 80, 100), anchors[k], anchors[k + 1], width)
+
+    def get_render_cache(self):
+        cache = self.render_cache
+        if cache is None:
+            cache = self.render_cache = RenderCache()
+        if cache.version != self.bodies.version:
+            cache.build(self.bodies)
+        return cache
+
+    # Where body name is drawn (between ticks when interpolating)
+    def get_render_position(self, name):
+        body = self.bodies[name]
+        if not self.interpolate or self.render_alpha >= 1.0:
+            return list(body.position)
+        cache = self.get_render_cache()
+        positions, angles = cache.pose(self.render_alpha)
+        return list(positions[cache.index[body]])
+
+    # Ground texture, loaded on first use. Needs a display to convert to, so
+    # offscreen-only rendering goes without.
+    def get_grass(self):
+        if self.grass is None:
+            try:
+                self.grass = pygame.image.load('grass.jpg').convert()
+            except:
+                self.grass = False
+        return self.grass
+
     def quit(self):
-        pygame.quit()
+        if self.pygame_ready:
+            pygame.quit()
+            self.pygame_ready = False
+            self.screen = None
+            self.font = None
+            self.clock = None
 
 if __name__ == '__main__':
     eng = Engine()
@@ -0,0 +1,173 @@
+'''
+
+This is the client side (and wire protocol) of env_server.py. It only needs
+the standard library, so learners can step remote environments without
+importing pygame or Box2D.
+
+Every message is a frame: a little-endian uint32 body length followed by the
+body. Request bodies start with REQUEST_HEADER (op, request id, env id), step
+requests then carry the action as an int32 (-1 for no action). Response bodies
+start with RESPONSE_HEADER (op, request id, env id, status) followed by:
+
+- OP_RESET: uint16 n, then n float32 observation values
+- OP_STEP:  uint8 done, float32 reward, uint16 n, then n float32 values
+- OP_INFO:  uint16 number of envs, uint16 observation size
+- any op with STATUS_ERROR: a utf-8 error message
+
+Responses carry the request id, so several requests may be in flight on the
+same connection (pipelining). Requests for the same env are answered in order.
+
+'''
+
+import socket
+import struct
+
+# =====
+# Protocol
+# =====
+
+OP_INFO = 0
+OP_RESET = 1
+OP_STEP = 2
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+FRAME_HEADER = struct.Struct('<I')
+REQUEST_HEADER = struct.Struct('<BIH')
+RESPONSE_HEADER = struct.Struct('<BIHB')
+ACTION = struct.Struct('<i')
+STEP_HEADER = struct.Struct('<BfH')
+OBS_HEADER = struct.Struct('<H')
+INFO = struct.Struct('<HH')
+
+NO_ACTION = -1
+
+# 'unix:/path/to.sock', '/path/to.sock' or 'host:port'
+def parse_address(address):
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    if '/' in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host or 'localhost', int(port))
+
+def pack_frame(body):
+    return FRAME_HEADER.pack(len(body)) + body
+
+def pack_request(op, request_id, env_id, action=None):
+    body = REQUEST_HEADER.pack(op, request_id, env_id)
+    if op == OP_STEP:
+        body += ACTION.pack(NO_ACTION if action is None else action)
+    return pack_frame(body)
+
+def unpack_observation(body, offset):
+    n, = OBS_HEADER.unpack_from(body, offset)
+    offset += OBS_HEADER.size
+    return list(struct.unpack_from('<%df' % n, body, offset))
+
+# Returns (op, request id, env id, result) where result is the observation
+# for OP_RESET, (observation, reward, done) for OP_STEP and
+# (num_envs, obs_dim) for OP_INFO
+def unpack_response(body):
+    op, request_id, env_id, status = RESPONSE_HEADER.unpack_from(body)
+    offset = RESPONSE_HEADER.size
+    if status != STATUS_OK:
+        raise RuntimeError('EnvServer error: ' + body[offset:].decode('utf-8', 'replace'))
+    if op == OP_RESET:
+        result = unpack_observation(body, offset)
+    elif op == OP_STEP:
+        done, reward, n = STEP_HEADER.unpack_from(body, offset)
+        observation = list(struct.unpack_from('<%df' % n, body, offset + STEP_HEADER.size))
+        result = (observation, reward, bool(done))
+    elif op == OP_INFO:
+        result = INFO.unpack_from(body, offset)
+    else:
+        raise ValueError('Unsupported op ' + str(op))
+    return op, request_id, env_id, result
+
+# =====
+# Client
+# =====
+
+class EnvClient():
+
+    sock = None
+    num_envs = 0
+    obs_dim = 0
+
+    # Responses received while waiting for another request
+    received = None
+    next_id = 0
+
+    def __init__(self, address, timeout=None):
+        family, sockaddr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(sockaddr)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.received = {}
+        self.num_envs, self.obs_dim = self.wait(self.send(OP_INFO, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ===== Pipelined interface =====
+
+    def send(self, op, env_id, action=None):
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        self.sock.sendall(pack_request(op, request_id, env_id, action))
+        return request_id
+
+    def send_reset(self, env_id):
+        return self.send(OP_RESET, env_id)
+
+    def send_step(self, env_id, action):
+        return self.send(OP_STEP, env_id, action)
+
+    # Next response off the wire: (request id, result)
+    def recv(self):
+        header = self.read_exactly(FRAME_HEADER.size)
+        body = self.read_exactly(FRAME_HEADER.unpack(header)[0])
+        try:
+            op, request_id, env_id, result = unpack_response(body)
+        except RuntimeError as e:
+            return RESPONSE_HEADER.unpack_from(body)[1], e
+        return request_id, result
+
+    # Result of one request (raises if the server reported an error)
+    def wait(self, request_id):
+        while request_id not in self.received:
+            received_id, result = self.recv()
+            self.received[received_id] = result
+        result = self.received.pop(request_id)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('EnvClient error: server closed the connection')
+            data += chunk
+        return data
+
+    # ===== Blocking interface =====
+
+    def reset(self, env_id):
+        return self.wait(self.send_reset(env_id))
+
+    def step(self, env_id, action):
+        return self.wait(self.send_step(env_id, action))
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,245 @@
+'''
+
+This keeps warm Uniped environments for services that create and discard
+environments per request. Environments are built once per morphology and
+settings, handed out already reset by checkout(), and reset in a background
+thread after release(), so construction and resets stay out of request
+latency. The pool holds at most max_envs environments and evicts idle ones
+of the least recently used settings first.
+
+    pool = env_pool.EnvPool(max_envs=32)
+    pool.warm('kangaroo', 4, max_tilt=1.2)
+    env = pool.checkout('kangaroo', max_tilt=1.2)
+    ...
+    pool.release(env)
+
+'''
+
+import collections
+import json
+import queue
+import threading
+import time
+
+import uniped
+
+# Settings are compared by value, so equal dicts of terrain/randomization
+# arguments share environments
+def pool_key(morphology, env_kwargs):
+    return (str(morphology), json.dumps(env_kwargs, sort_keys=True, default=repr))
+
+class EnvPool():
+
+    # Limits
+    max_envs = 64 # environments held, idle and checked out
+    max_idle = 8 # reset environments kept ready per key
+
+    # key -> deque of reset environments, least recently used key first
+    ready = None
+    # id(env) -> key, for every environment checked out
+    owners = None
+    num_envs = 0 # held environments (including ones being built)
+
+    # Background resets/builds: ('reset', env, key) or ('build', key,
+    # morphology, env_kwargs)
+    tasks = None
+
+    # Counters
+    hits = 0 # checkouts served by a ready environment
+    misses = 0 # checkouts that had to build one
+
+    closed = False
+
+    def __init__(self, max_envs=64, max_idle=8):
+        self.max_envs = max_envs
+        self.max_idle = max_idle
+        self.ready = collections.OrderedDict()
+        self.owners = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.tasks = queue.Queue()
+        self.thread = threading.Thread(target=self.run_tasks, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ===== Requests =====
+
+    # A reset environment for morphology and env_kwargs (see uniped.make).
+    # Builds one if none is ready; waits up to timeout seconds (None = for
+    # ever) if the pool is full of checked out environments.
+    def checkout(self, morphology, timeout=None, **env_kwargs):
+        key = pool_key(morphology, env_kwargs)
+        with self.changed:
+            if self.closed:
+                raise ValueError('Pool error: pool is closed')
+            env = self.take(key)
+            if env is None:
+                # An environment of key may be released while waiting for room
+                env = self.reserve(key, timeout)
+            if env is not None:
+                self.owners[id(env)] = key
+                self.hits += 1
+                return env
+            self.misses += 1
+        env = self.build(morphology, env_kwargs)
+        with self.lock:
+            self.owners[id(env)] = key
+        return env
+
+    # Hand env back; it is reset in the background and then ready again
+    # (or closed right away if the pool is closed)
+    def release(self, env):
+        with self.lock:
+            key = self.owners.pop(id(env), None)
+            if key is None:
+                raise ValueError('Pool error: environment is not checked out from this pool (released twice?)')
+            if self.closed:
+                self.num_envs -= 1
+            else:
+                # Queued with the lock held, so ahead of close()'s sentinel
+                self.tasks.put(('reset', env, key))
+                return
+        env._close()
+
+    # Build count environments for morphology and env_kwargs in the
+    # background, ahead of the requests that will check them out
+    def warm(self, morphology, count=1, **env_kwargs):
+        key = pool_key(morphology, env_kwargs)
+        with self.lock:
+            if self.closed:
+                raise ValueError('Pool error: pool is closed')
+        for _ in range(count):
+            self.tasks.put(('build', key, morphology, env_kwargs))
+
+    def stats(self):
+        with self.lock:
+            idle = sum(len(ready) for ready in self.ready.values())
+            return {
+                'envs': self.num_envs,
+                'idle': idle,
+                'checked_out': len(self.owners),
+                'keys': len(self.ready),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle = [env for ready in self.ready.values() for env in ready]
+            self.ready.clear()
+            self.num_envs -= len(idle)
+            # Checkouts waiting for room give up
+            self.changed.notify_all()
+        self.tasks.put(None)
+        self.thread.join()
+        for env in idle:
+            env._close()
+
+    # ===== Bookkeeping (with the lock held) =====
+
+    # A ready environment of key, or None
+    def take(self, key):
+        ready = self.ready.get(key)
+        if not ready:
+            return None
+        env = ready.pop()
+        if ready:
+            self.ready.move_to_end(key)
+        else:
+            del self.ready[key]
+        return env
+
+    # Make room for one more environment: evict idle ones of the least
+    # recently used keys, or wait for releases if everything is checked out.
+    # Returns an environment of key if one is released meanwhile (no room
+    # taken then), else None.
+    def reserve(self, key, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.num_envs >= self.max_envs:
+            env = self.take(key)
+            if env is not None:
+                return env
+            if not self.evict_one():
+                if self.closed:
+                    raise ValueError('Pool error: pool is closed')
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('Pool error: all %d environments are checked out' % self.max_envs)
+                self.changed.wait(remaining)
+        self.num_envs += 1
+        return None
+
+    def evict_one(self):
+        for key, ready in self.ready.items():
+            if ready:
+                env = ready.popleft()
+                if not ready:
+                    del self.ready[key]
+                self.num_envs -= 1
+                env._close()
+                return True
+        return False
+
+    # Put a reset env back on the ready list of key (or drop it)
+    def file(self, env, key):
+        ready = self.ready.setdefault(key, collections.deque())
+        if self.closed or len(ready) >= self.max_idle:
+            if not ready:
+                del self.ready[key]
+            self.num_envs -= 1
+            env._close()
+        else:
+            ready.append(env)
+            self.ready.move_to_end(key)
+        self.changed.notify_all()
+
+    # ===== Background thread =====
+
+    def build(self, morphology, env_kwargs):
+        env_kwargs = dict(env_kwargs)
+        env_kwargs.setdefault('render_window', False)
+        try:
+            return uniped.make(morphology, **env_kwargs)
+        except Exception:
+            with self.changed:
+                self.num_envs -= 1
+                self.changed.notify_all()
+            raise
+
+    def run_tasks(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            if task[0] == 'reset':
+                kind, env, key = task
+                try:
+                    env._reset()
+                except Exception:
+                    # Broken environment: drop it
+                    with self.changed:
+                        self.num_envs -= 1
+                        self.changed.notify_all()
+                    env._close()
+                    continue
+                with self.changed:
+                    self.file(env, key)
+            else:
+                kind, key, morphology, env_kwargs = task
+                with self.changed:
+                    if self.closed or self.num_envs >= self.max_envs:
+                        continue
+                    self.num_envs += 1
+                try:
+                    # Environments are built reset
+                    env = self.build(morphology, env_kwargs)
+                except Exception:
+                    continue
+                with self.changed:
+                    self.file(env, key)
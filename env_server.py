@@ -0,0 +1,223 @@
+'''
+
+This hosts a pool of Uniped environments behind a Unix-domain or TCP socket.
+Concurrent step requests (from any number of connections) are batched into a
+single VectorUniped step. See env_client.py for the wire protocol.
+
+'''
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import os
+import socket
+import struct
+
+import env_client
+import vector_uniped
+
+# A request waiting for the next batch
+Request = collections.namedtuple('Request', ['op', 'request_id', 'env_id', 'action', 'writer'])
+
+class EnvServer():
+
+    # The environments
+    envs = None
+
+    # Requests waiting for the next batch, and the event that wakes the batcher
+    pending = None
+    wakeup = None
+
+    # Seconds to wait for more requests once one arrives (0 = batch whatever is queued)
+    batch_window = 0.0
+
+    # Runs vectorized steps so the event loop keeps reading sockets meanwhile
+    executor = None
+
+    def __init__(self, morphology, num_envs, batch_window=0.0, **env_kwargs):
+        self.envs = vector_uniped.VectorUniped(morphology, num_envs, **env_kwargs)
+        self.batch_window = batch_window
+        self.pending = collections.deque()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    # ===== Serving =====
+
+    async def start(self, address):
+        family, sockaddr = env_client.parse_address(address)
+        self.wakeup = asyncio.Event()
+        self.batcher = asyncio.ensure_future(self.run_batches())
+        if family == socket.AF_UNIX:
+            if os.path.exists(sockaddr):
+                os.unlink(sockaddr)
+            self.server = await asyncio.start_unix_server(self.handle_connection, sockaddr)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, *sockaddr)
+        return self.server
+
+    async def serve_forever(self, address):
+        server = await self.start(address)
+        async with server:
+            await server.serve_forever()
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.executor.shutdown()
+        self.envs.close()
+
+    async def handle_connection(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                header = await reader.readexactly(env_client.FRAME_HEADER.size)
+                size, = env_client.FRAME_HEADER.unpack(header)
+                body = await reader.readexactly(size)
+                self.handle_request(body, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except struct.error:
+            # Frame too short for a request header: nothing to reply to,
+            # and the stream can't be trusted any more
+            pass
+        finally:
+            writer.close()
+
+    def handle_request(self, body, writer):
+        op, request_id, env_id = env_client.REQUEST_HEADER.unpack_from(body)
+        if op == env_client.OP_INFO:
+            writer.write(self.pack_info(request_id))
+        elif op not in (env_client.OP_RESET, env_client.OP_STEP):
+            writer.write(self.pack_error(op, request_id, env_id, 'unsupported op ' + str(op)))
+        elif env_id >= len(self.envs):
+            writer.write(self.pack_error(op, request_id, env_id, 'no env ' + str(env_id)))
+        else:
+            action = None
+            if op == env_client.OP_STEP:
+                try:
+                    action, = env_client.ACTION.unpack_from(body, env_client.REQUEST_HEADER.size)
+                except struct.error:
+                    writer.write(self.pack_error(op, request_id, env_id, 'truncated step request'))
+                    return
+                if action == env_client.NO_ACTION:
+                    action = None
+            self.pending.append(Request(op, request_id, env_id, action, writer))
+            self.wakeup.set()
+
+    # ===== Batching =====
+
+    def take_batch(self):
+        # At most one request per env, keeping per-env request order
+        batch = []
+        deferred = collections.deque()
+        seen = set()
+        while self.pending:
+            request = self.pending.popleft()
+            if request.env_id in seen:
+                deferred.append(request)
+            else:
+                seen.add(request.env_id)
+                batch.append(request)
+        self.pending = deferred
+        return batch
+
+    def run_batch(self, resets, steps):
+        # Runs on the executor thread
+        if resets:
+            self.envs.reset([request.env_id for request in resets])
+        if steps:
+            self.envs.step(
+                [request.action for request in steps],
+                [request.env_id for request in steps]
+            )
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.wakeup.wait()
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+            self.wakeup.clear()
+
+            batch = self.take_batch()
+            resets = [request for request in batch if request.op == env_client.OP_RESET]
+            steps = [request for request in batch if request.op == env_client.OP_STEP]
+            try:
+                await loop.run_in_executor(self.executor, self.run_batch, resets, steps)
+                responses = self.pack_results(resets, steps)
+            except Exception as e:
+                responses = [
+                    (request.writer, self.pack_error(request.op, request.request_id, request.env_id, repr(e)))
+                    for request in batch
+                ]
+
+            writers = set()
+            for writer, frame in responses:
+                if not writer.is_closing():
+                    writer.write(frame)
+                    writers.add(writer)
+            for writer in writers:
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+            if self.pending:
+                self.wakeup.set()
+
+    # ===== Encoding =====
+
+    def pack_results(self, resets, steps):
+        responses = []
+        obs_header = env_client.OBS_HEADER.pack(self.envs.obs_dim)
+        if resets:
+            rows = self.envs.observations[[request.env_id for request in resets]].astype('<f4')
+            for request, row in zip(resets, rows):
+                body = env_client.RESPONSE_HEADER.pack(
+                    request.op, request.request_id, request.env_id, env_client.STATUS_OK
+                ) + obs_header + row.tobytes()
+                responses.append((request.writer, env_client.pack_frame(body)))
+        if steps:
+            indices = [request.env_id for request in steps]
+            rows = self.envs.observations[indices].astype('<f4')
+            rewards = self.envs.rewards[indices]
+            dones = self.envs.dones[indices]
+            for request, row, reward, done in zip(steps, rows, rewards, dones):
+                body = env_client.RESPONSE_HEADER.pack(
+                    request.op, request.request_id, request.env_id, env_client.STATUS_OK
+                ) + env_client.STEP_HEADER.pack(
+                    bool(done), reward, self.envs.obs_dim
+                ) + row.tobytes()
+                responses.append((request.writer, env_client.pack_frame(body)))
+        return responses
+
+    def pack_info(self, request_id):
+        body = env_client.RESPONSE_HEADER.pack(
+            env_client.OP_INFO, request_id, 0, env_client.STATUS_OK
+        ) + env_client.INFO.pack(len(self.envs), self.envs.obs_dim)
+        return env_client.pack_frame(body)
+
+    def pack_error(self, op, request_id, env_id, message):
+        body = env_client.RESPONSE_HEADER.pack(
+            op, request_id, env_id, env_client.STATUS_ERROR
+        ) + message.encode('utf-8')
+        return env_client.pack_frame(body)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve Uniped environments over a socket')
+    parser.add_argument('morphology', help='morphology module, e.g. kangaroo or pogo')
+    parser.add_argument('--envs', type=int, default=16)
+    parser.add_argument('--address', default='unix:/tmp/robo_qwop.sock',
+                        help="'unix:/path' or 'host:port'")
+    parser.add_argument('--batch-window', type=float, default=0.0,
+                        help='seconds to wait for more step requests before stepping')
+    args = parser.parse_args()
+
+    server = EnvServer(args.morphology, args.envs, args.batch_window)
+    try:
+        asyncio.run(server.serve_forever(args.address))
+    except KeyboardInterrupt:
+        pass
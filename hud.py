@@ -0,0 +1,100 @@
+'''
+
+This draws the heads-up display over a rendered frame: lines of text whose
+rendered surfaces are cached by string, so unchanged lines cost a blit
+instead of a font rasterization, plus optional live performance counters
+(physics steps per second, render FPS, dropped frames)
+
+'''
+
+import collections
+import time
+
+import engine
+
+TEXT_COLOR = (80, 80, 80)
+
+class Hud():
+
+    # Rendered text surfaces by (text, color), least recently used first
+    cache = None
+    max_cached = 256
+    font = None # font the cache was rendered with
+
+    # Performance counters (off = only the caller's lines)
+    show_perf = False
+    perf_interval = 1.0 # seconds between counter updates
+    perf_start = None
+    perf_ticks = 0 # physics steps since perf_start
+    perf_frames = 0 # frames drawn since perf_start
+    last_ticks = 0
+    last_frame = None
+    dropped_frames = 0 # frame slots missed since the HUD started
+    perf_lines = None
+
+    def __init__(self, show_perf=False, max_cached=256):
+        self.cache = collections.OrderedDict()
+        self.max_cached = max_cached
+        self.show_perf = show_perf
+        self.perf_lines = []
+
+    # Fixed-precision text for a fast-changing number, so that values that
+    # look the same give the same string (and hit the cache)
+    def number(self, value, digits=2):
+        return '%.*f' % (digits, round(value, digits) + 0.0)
+
+    def text(self, eng, text, color=TEXT_COLOR):
+        font = eng.get_font()
+        if font is not self.font:
+            self.cache.clear()
+            self.font = font
+
+        key = (text, color)
+        surface = self.cache.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.cache[key] = surface
+            if len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        return surface
+
+    # Draw lines top to bottom from location (custom_render function, see
+    # Engine.render)
+    def draw(self, eng, lines, location=(8, 0)):
+        if self.show_perf:
+            self.update_perf(eng)
+            lines = lines + self.perf_lines
+        x, y = location
+        line_height = eng.font_size
+        for k, line in enumerate(lines):
+            eng.screen.blit(self.text(eng, line), (x, y + k * line_height))
+
+    def update_perf(self, eng):
+        now = time.perf_counter()
+        if self.perf_start is None:
+            self.perf_start = now
+            self.last_frame = now
+            self.last_ticks = eng.num_ticks
+
+        # Physics steps (num_ticks starts over on every reset)
+        ticks = eng.num_ticks
+        self.perf_ticks += ticks - self.last_ticks if ticks >= self.last_ticks else ticks
+        self.last_ticks = ticks
+
+        # Frames, and the frame slots (at DISPLAY_FPS) skipped since the last
+        self.perf_frames += 1
+        self.dropped_frames += max(0, int(round((now - self.last_frame) * engine.DISPLAY_FPS)) - 1)
+        self.last_frame = now
+
+        elapsed = now - self.perf_start
+        if elapsed >= self.perf_interval:
+            self.perf_lines = [
+                'steps/s: %d' % round(self.perf_ticks / elapsed),
+                'render fps: %.1f' % (self.perf_frames / elapsed),
+                'dropped frames: %d' % self.dropped_frames
+            ]
+            self.perf_start = now
+            self.perf_ticks = 0
+            self.perf_frames = 0
@@ -1,13 +1,19 @@
 import Box2D.b2 as b2
 
 import engine
-import pygame
 
 # Groups for filtering collisions
 # NOTE: the ground by default has collision category 01
-ROBOT_NOGROUND = 0x01 # do not collide some robot components with the ground
+ROBOT_NOGROUND = 0x04 # do not collide some robot components with the ground
 ROBOT = 0x02 # do not collide robot components with themselves
 
+# Masks: what each robot component collides with. Components joined by a
+# joint never collide (Box2D leaves those pairs out by itself); any other
+# pair can touch and push, so everything collides with everything.
+COLLIDE_ALL = engine.GROUND_CATEGORY | ROBOT | ROBOT_NOGROUND
+COLLIDE_GROUND = engine.GROUND_CATEGORY
+COLLIDE_NOTHING = 0x00
+
 objects = [
     {
         "name": "body",
@@ -21,7 +27,8 @@ objects = [
             "density": 0.5,
             "friction": 0.3
         },
-        "category": ROBOT
+        "category": ROBOT,
+        "mask": COLLIDE_ALL
     },
     {
         "name": "leg_thigh",
@@ -35,7 +42,8 @@ objects = [
             "density": 1,
             "friction": 0.3
         },
-        "category": ROBOT | ROBOT_NOGROUND
+        "category": ROBOT | ROBOT_NOGROUND,
+        "mask": COLLIDE_ALL
     },
     {
         "name": "leg_upper",
@@ -49,7 +57,8 @@ objects = [
             "density": 1,
             "friction": 0.3
         },
-        "category": ROBOT | ROBOT_NOGROUND
+        "category": ROBOT | ROBOT_NOGROUND,
+        "mask": COLLIDE_ALL
     },
     {
         "name": "leg_lower",
@@ -63,7 +72,8 @@ objects = [
             "density": 1,
             "friction": 0.3
         },
-        "category": ROBOT | ROBOT_NOGROUND
+        "category": ROBOT | ROBOT_NOGROUND,
+        "mask": COLLIDE_ALL
     },
     {
         "name": "foot",
@@ -77,7 +87,8 @@ objects = [
             "density": 1,
             "friction": 3.5
         },
-        "category": ROBOT
+        "category": ROBOT,
+        "mask": COLLIDE_ALL
     },
     {
         "name": "tail1",
@@ -91,7 +102,8 @@ objects = [
             "density": 0.5,
             "friction": 0.3
         },
-        "category": ROBOT | ROBOT_NOGROUND
+        "category": ROBOT | ROBOT_NOGROUND,
+        "mask": COLLIDE_ALL
     },
     {
         "name": "tail2",
@@ -105,7 +117,8 @@ objects = [
             "density": 0.5,
             "friction": 0.3
         },
-        "category": ROBOT | ROBOT_NOGROUND
+        "category": ROBOT | ROBOT_NOGROUND,
+        "mask": COLLIDE_ALL
     },
     {
         "name": "tail3",
@@ -119,7 +132,8 @@ objects = [
             "density": 0.5,
             "friction": 0.3
         },
-        "category": ROBOT | ROBOT_NOGROUND
+        "category": ROBOT | ROBOT_NOGROUND,
+        "mask": COLLIDE_ALL
     },
     {
         "name": "head",
@@ -133,10 +147,29 @@ objects = [
             "density": 1,
             "friction": 0.3
         },
-        "category": ROBOT
+        "category": ROBOT,
+        "mask": COLLIDE_ALL
     }
 ]
 
+# Opt-in lean collisions, as the categories above describe them: the
+# ROBOT_NOGROUND components collide with nothing, the rest only with the
+# ground. Far fewer contacts, but a different robot: legs and tail pass
+# through the body and the ground. Used by the morphology 'kangaroo:lean'
+# (see morphology.resolve).
+lean_masks = {
+    "body": COLLIDE_GROUND,
+    "leg_thigh": COLLIDE_NOTHING,
+    "leg_upper": COLLIDE_NOTHING,
+    "leg_lower": COLLIDE_NOTHING,
+    "foot": COLLIDE_GROUND,
+    "tail1": COLLIDE_NOTHING,
+    "tail2": COLLIDE_NOTHING,
+    "tail3": COLLIDE_NOTHING,
+    "head": COLLIDE_GROUND
+}
+lean_objects = [dict(obj, mask=lean_masks[obj['name']]) for obj in objects]
+
 '''
 foot
 
@@ -506,7 +539,7 @@ def handle_remove_controls(self, world, bodies, body_names, joints, joint_names,
 # ===== RESET =====
 
 def reset(self, world, bodies, body_names, joints, joint_names, custom_dat):
-    custom_dat.reset()
+    custom_dat._reset()
 
 # ===== CLICK AND DRAG ROBOT =====
 
@@ -530,113 +563,113 @@ def handle_mouseup(self, world, bodies, body_names, joints, joint_names, custom_
 
 key_events = [
     {
-        'key': pygame.K_x,
-        'type': pygame.KEYDOWN,
+        'key': 'K_x',
+        'type': 'KEYDOWN',
         'fn': remove_joints,
         'body_names': [],
         'joint_names': [],
     },
     {
-        'key': pygame.K_q,
-        'type': pygame.KEYDOWN,
+        'key': 'K_q',
+        'type': 'KEYDOWN',
         'fn': joint_ccw,
         'body_names': [],
         'joint_names': ["joint_top"],
     },
     {
-        'key': pygame.K_q,
-        'type': pygame.KEYUP,
+        'key': 'K_q',
+        'type': 'KEYUP',
         'fn': handle_remove_controls,
         'body_names': [],
         'joint_names': ["joint_top"],
     },
     {
-        'key': pygame.K_w,
-        'type': pygame.KEYDOWN,
+        'key': 'K_w',
+        'type': 'KEYDOWN',
         'fn':joint_cw,
         'body_names': [],
         'joint_names': ["joint_top"],
     },
     {
-        'key': pygame.K_w,
-        'type': pygame.KEYUP,
+        'key': 'K_w',
+        'type': 'KEYUP',
         'fn': handle_remove_controls,
         'body_names': [],
         'joint_names': ["joint_top"],
     },
     {
-        'key': pygame.K_o,
-        'type': pygame.KEYDOWN,
+        'key': 'K_o',
+        'type': 'KEYDOWN',
         'fn': joint_ccw,
         'body_names': [],
         'joint_names': ["joint_knee"],
     },
     {
-        'key': pygame.K_o,
-        'type': pygame.KEYUP,
+        'key': 'K_o',
+        'type': 'KEYUP',
         'fn': handle_remove_controls,
         'body_names': [],
         'joint_names': ["joint_knee"],
     },
     {
-        'key': pygame.K_p,
-        'type': pygame.KEYDOWN,
+        'key': 'K_p',
+        'type': 'KEYDOWN',
         'fn': joint_cw,
         'body_names': [],
         'joint_names': ["joint_knee"],
     },
     {
-        'key': pygame.K_p,
-        'type': pygame.KEYUP,
+        'key': 'K_p',
+        'type': 'KEYUP',
         'fn': handle_remove_controls,
         'body_names': [],
         'joint_names': ["joint_knee"],
     },
     {
-        'key': pygame.K_e,
-        'type': pygame.KEYDOWN,
+        'key': 'K_e',
+        'type': 'KEYDOWN',
         'fn': joint_ccw,
         'body_names': [],
         'joint_names': ["joint_thigh"],
     },
     {
-        'key': pygame.K_e,
-        'type': pygame.KEYUP,
+        'key': 'K_e',
+        'type': 'KEYUP',
         'fn': handle_remove_controls,
         'body_names': [],
         'joint_names': ["joint_thigh"],
     },
     {
-        'key': pygame.K_i,
-        'type': pygame.KEYDOWN,
+        'key': 'K_i',
+        'type': 'KEYDOWN',
         'fn': joint_cw,
         'body_names': [],
         'joint_names': ["joint_thigh"],
     },
     {
-        'key': pygame.K_i,
-        'type': pygame.KEYUP,
+        'key': 'K_i',
+        'type': 'KEYUP',
         'fn': handle_remove_controls,
         'body_names': [],
         'joint_names': ["joint_thigh"],
     },
     {
-        'key': pygame.K_r,
-        'type': pygame.KEYDOWN,
+        'key': 'K_r',
+        'type': 'KEYDOWN',
         'fn': reset,
         'body_names': [],
         'joint_names': [],
     },
     {
         'key': None,
-        'type': pygame.MOUSEBUTTONDOWN,
+        'type': 'MOUSEBUTTONDOWN',
         'fn': handle_mousedown,
         'body_names': ["body"],
         'joint_names': ["joint_mouse"],
     },
     {
         'key': None,
-        'type': pygame.MOUSEBUTTONUP,
+        'type': 'MOUSEBUTTONUP',
         'fn': handle_mouseup,
         'body_names': [],
         'joint_names': ["joint_mouse"],
@@ -738,17 +771,8 @@ control_events = [
 
 if __name__ == '__main__':
     import uniped
-    up = uniped.Uniped(
-        objects, joints, key_events, control_events,
-        'body',
-        True, False, 'file.ogv'
-    )
-    while True:
-        up.step(None)
-        up.render()
-        if up._is_done(up._get_state()):
-            print('FINISHED!')
-            #up.reset()
+    up = uniped.Uniped(objects, joints, key_events, control_events, 'body')
+    uniped.play(up, on_done=lambda info: print('FINISHED! (%s)' % info['termination']))
 
 
     '''
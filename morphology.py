@@ -0,0 +1,297 @@
+'''
+
+This loads morphologies (the bodies and joints of a robot) from JSON/TOML
+files and compiles them into build plans: ready-made Box2D body, fixture and
+joint definitions that are replayed into a world on every reset
+
+    python3 morphology.py export kangaroo --out kangaroo.json
+
+'''
+
+import argparse
+import collections
+import hashlib
+import importlib
+import json
+import threading
+
+import Box2D.b2 as b2
+
+import engine
+
+try:
+    import tomllib # Python 3.11+
+except ImportError:
+    tomllib = None
+
+SHAPE_TYPES = ('poly', 'circle')
+JOINT_TYPES = ('revolute', 'prismatic', 'weld', 'rope')
+
+OBJECT_KEYS = (
+    'name', 'obj_args', 'shape_type', 'shape_args', 'color', 'fixed',
+    'category', 'mask', 'group'
+)
+JOINT_KEYS = ('name', 'joint_type', 'obj1_name', 'obj2_name', 'joint_args', 'anchor_offset')
+
+# Compiled plans, keyed by the content hash of their spec, least recently
+# used first. Each holds a scratch Box2D world, and sweeps compile one per
+# variant, so only the MAX_PLANS most recent are kept (envs keep their own
+# plan alive).
+MAX_PLANS = 32
+plans = collections.OrderedDict()
+plans_lock = threading.Lock()
+
+# =====
+# Loading and validation
+# =====
+
+# Read a morphology file. Besides 'objects' and 'joints' it names the module
+# whose 'key_events'/'control_events' drive it ('controls', since functions
+# cannot live in a data file).
+def load(path):
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise ValueError('Morphology error: loading TOML requires Python 3.11+ (tomllib)')
+        with open(path, 'rb') as f:
+            spec = tomllib.load(f)
+    else:
+        with open(path) as f:
+            spec = json.load(f)
+
+    if 'objects' not in spec or 'joints' not in spec:
+        raise ValueError('Morphology error: ' + path + ' needs both objects and joints')
+    validate(spec['objects'], spec['joints'])
+    return spec
+
+def is_file(morphology):
+    return morphology.endswith('.json') or morphology.endswith('.toml')
+
+# (objects, joints, controls module) of a morphology module name ('kangaroo'),
+# a variant of its objects ('kangaroo:lean' = kangaroo.lean_objects) or a
+# file ('kangaroo.json')
+def resolve(morphology):
+    if is_file(morphology):
+        spec = load(morphology)
+        return spec['objects'], spec['joints'], importlib.import_module(spec['controls'])
+    name, _, variant = morphology.partition(':')
+    module = importlib.import_module(name)
+    if not variant:
+        return module.objects, module.joints, module
+    objects = getattr(module, variant + '_objects', None)
+    if objects is None:
+        raise ValueError('Morphology error: ' + name + ' has no ' + variant + ' variant')
+    return objects, module.joints, module
+
+def validate(objects, joints):
+    body_names = set()
+    for obj in objects:
+        name = obj.get('name')
+        if name is None:
+            raise ValueError('Morphology error: object without a name')
+        if name in body_names or name in ('ground', 'mouse'):
+            raise ValueError('Morphology error: duplicate object name ' + name)
+        body_names.add(name)
+        for key in obj:
+            if key not in OBJECT_KEYS:
+                raise ValueError('Morphology error: object ' + name + ' has unknown key ' + key)
+        if obj.get('shape_type') not in SHAPE_TYPES:
+            raise ValueError('Morphology error: object ' + name + ' has unsupported shape type ' + str(obj.get('shape_type')))
+        for key in obj.get('obj_args', {}):
+            if not hasattr(b2.bodyDef, key):
+                raise ValueError('Morphology error: object ' + name + ' has unknown body argument ' + key)
+        shape_class = b2.polygonShape if obj['shape_type'] == 'poly' else b2.circleShape
+        for key in obj.get('shape_args', {}):
+            if not hasattr(shape_class, key) and not hasattr(b2.fixtureDef, key):
+                raise ValueError('Morphology error: object ' + name + ' has unknown shape argument ' + key)
+
+    joint_names = set()
+    for joint in joints:
+        name = joint.get('name')
+        if name is None:
+            raise ValueError('Morphology error: joint without a name')
+        if name in joint_names:
+            raise ValueError('Morphology error: duplicate joint name ' + name)
+        joint_names.add(name)
+        for key in joint:
+            if key not in JOINT_KEYS:
+                raise ValueError('Morphology error: joint ' + name + ' has unknown key ' + key)
+        if joint.get('joint_type') not in JOINT_TYPES:
+            raise ValueError('Morphology error: joint ' + name + ' has unsupported joint type ' + str(joint.get('joint_type')))
+        for key in ('obj1_name', 'obj2_name'):
+            if joint.get(key) not in body_names:
+                raise ValueError('Morphology error: joint ' + name + ' connects unknown object ' + str(joint.get(key)))
+
+def spec_hash(objects, joints):
+    text = json.dumps({'objects': objects, 'joints': joints}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+# =====
+# Build plans
+# =====
+
+# Validated, compiled morphology. Body and fixture definitions are made once;
+# joint definitions are made once against a scratch world (anchors, axes and
+# reference angles only depend on the spawn pose), so a build only has to
+# point them at the new bodies.
+class BuildPlan():
+
+    key = None
+
+    # Per body: (name, body def, spawn position, [(fixture def, shape)],
+    # filter, color)
+    bodies = None
+
+    # Per joint: (name, obj1 name, obj2 name, joint def)
+    joints = None
+    scratch_world = None
+
+    # Whether the spec lets its components collide with each other
+    self_collide = True
+
+    # Builds write into the shared defs, so builds of the same plan (e.g.
+    # from several threads of an env_pool.EnvPool) take turns
+    lock = None
+
+    def __init__(self, objects, joints, key=None):
+        self.key = key
+        self.bodies = []
+        self.joints = []
+        self.lock = threading.Lock()
+
+        for obj in objects:
+            body_def = b2.bodyDef(**obj.get('obj_args', {}))
+            body_def.type = b2.staticBody if obj.get('fixed', False) else b2.dynamicBody
+            position = tuple(body_def.position)
+
+            # Same split of shape and fixture properties as CreatePolygonFixture
+            shape_class = b2.polygonShape if obj['shape_type'] == 'poly' else b2.circleShape
+            shape = shape_class()
+            fixture_def = b2.fixtureDef(shape=shape)
+            for key, value in obj.get('shape_args', {}).items():
+                setattr(shape if hasattr(shape_class, key) else fixture_def, key, value)
+
+            collision_filter = b2.filter(
+                categoryBits=obj.get('category', 0x00),
+                maskBits=obj.get('mask', 0xFFFF),
+                groupIndex=obj.get('group', 0)
+            )
+            color = tuple(obj.get('color', (50, 50, 50, 100)))
+            self.bodies.append((obj['name'], body_def, position, [(fixture_def, shape)], collision_filter, color))
+
+        self.self_collide = any(
+            collision_filter.maskBits & other.categoryBits
+            for _, _, _, _, collision_filter, _ in self.bodies
+            for _, _, _, _, other, _ in self.bodies
+        )
+
+        # Resolve anchors in a scratch world holding the bodies at their spawn pose
+        world = b2.world()
+        bodies = {}
+        for name, body_def, position, fixtures, collision_filter, color in self.bodies:
+            bodies[name] = world.CreateBody(body_def)
+            for fixture_def, shape in fixtures:
+                bodies[name].CreateFixture(fixture_def)
+
+        for joint in joints:
+            body1 = bodies[joint['obj1_name']]
+            body2 = bodies[joint['obj2_name']]
+            joint_args = joint.get('joint_args', {})
+            anchor = body1.worldCenter + (joint.get('anchor_offset') or (0, 0))
+
+            joint_type = joint['joint_type']
+            if joint_type == 'revolute':
+                joint_def = b2.revoluteJointDef(bodyA=body1, bodyB=body2, anchor=anchor, **joint_args)
+            elif joint_type == 'prismatic':
+                joint_def = b2.prismaticJointDef(bodyA=body1, bodyB=body2, anchor=anchor, **joint_args)
+            elif joint_type == 'weld':
+                joint_def = b2.weldJointDef(bodyA=body1, bodyB=body2, anchor=anchor)
+                joint_def.frequencyHz = 0
+                joint_def.dampingRatio = 1
+            elif joint_type == 'rope':
+                joint_def = b2.ropeJointDef(bodyA=body1, bodyB=body2, **joint_args)
+            self.joints.append((joint['name'], joint['obj1_name'], joint['obj2_name'], joint_def))
+
+        # Kept alive so the defs never point at freed bodies; every build
+        # re-points them anyway
+        self.scratch_world = world
+
+    # Create the morphology in eng's world. Names get prefix, spawn positions
+    # offset, and a non-zero group puts every body in that collision group,
+    # which only collides with the ground (see MultiUniped). Within the group
+    # the components collide with each other (positive group) unless the
+    # spec's masks rule that out (negative group).
+    def build(self, eng, prefix='', offset=(0, 0), group=0):
+        with self.lock:
+            world = eng.world
+            bodies = eng.bodies
+
+            for name, body_def, position, fixtures, collision_filter, color in self.bodies:
+                body_def.position = (position[0] + offset[0], position[1] + offset[1])
+                if group:
+                    collision_filter = b2.filter(
+                        categoryBits=collision_filter.categoryBits,
+                        maskBits=collision_filter.maskBits & engine.GROUND_CATEGORY,
+                        groupIndex=group if self.self_collide else -group
+                    )
+
+                body = world.CreateBody(body_def)
+                for fixture_def, shape in fixtures:
+                    fixture_def.filter = collision_filter
+                    body.CreateFixture(fixture_def)
+                body.color = color
+                body.userData = {
+                    'name': prefix + name
+                }
+                bodies[prefix + name] = body
+
+            for name, obj1_name, obj2_name, joint_def in self.joints:
+                joint_def.bodyA = bodies[prefix + obj1_name]
+                joint_def.bodyB = bodies[prefix + obj2_name]
+                eng.joints[prefix + name] = world.CreateJoint(joint_def)
+
+# Compile (or fetch the cached plan of) a morphology
+def compile_plan(objects, joints):
+    key = spec_hash(objects, joints)
+    with plans_lock:
+        plan = plans.get(key)
+        if plan is not None:
+            plans.move_to_end(key)
+            return plan
+    validate(objects, joints)
+    plan = BuildPlan(objects, joints, key)
+    with plans_lock:
+        plan = plans.setdefault(key, plan)
+        plans.move_to_end(key)
+        while len(plans) > MAX_PLANS:
+            plans.popitem(last=False)
+    return plan
+
+# =====
+# Exporting module morphologies to data files
+# =====
+
+def export(morphology, path):
+    objects, joints, module = resolve(morphology)
+    spec = {
+        'controls': module.__name__,
+        'objects': objects,
+        'joints': joints
+    }
+    with open(path, 'w') as f:
+        json.dump(spec, f, indent=4)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Morphology data files')
+    parser.add_argument('command', choices=['export', 'check'])
+    parser.add_argument('morphology', help='morphology module (export) or file (check)')
+    parser.add_argument('--out', help='output .json file (export)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export(args.morphology, args.out or args.morphology.replace(':', '_') + '.json')
+    else:
+        spec = load(args.morphology)
+        plan = compile_plan(spec['objects'], spec['joints'])
+        print('%s: %d bodies, %d joints, key %s' % (
+            args.morphology, len(plan.bodies), len(plan.joints), plan.key
+        ))
@@ -0,0 +1,206 @@
+'''
+
+This normalizes the observations and rewards of a VectorUniped in place, on
+its preallocated arrays: observations by a running mean/variance per
+component, rewards by the running deviation of the discounted return. The
+running statistics are kept as (count, mean, M2) so those gathered
+separately (e.g. by rollout workers) merge exactly with the parallel Welford
+formula, and they export to plain arrays for checkpoints.
+
+'''
+
+import numpy as np
+
+# =====
+# Running statistics
+# =====
+
+class RunningStats():
+
+    count = 0.0
+    mean = None
+    m2 = None # sum of squared deviations from the mean
+
+    def __init__(self, shape=()):
+        self.count = 0.0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    @property
+    def var(self):
+        return self.m2 / self.count if self.count > 0 else np.ones_like(self.mean)
+
+    # Add a batch of samples (leading axis = samples)
+    def update(self, batch):
+        n = batch.shape[0]
+        if n == 0:
+            return
+        batch_mean = batch.mean(axis=0)
+        batch_m2 = ((batch - batch_mean) ** 2).sum(axis=0)
+        self.merge_moments(n, batch_mean, batch_m2)
+
+    # Parallel Welford (Chan et al.): combine with the moments of another
+    # set of samples, as if all of them had been added here
+    def merge_moments(self, count, mean, m2):
+        if count == 0:
+            return
+        if self.count == 0:
+            # Takes the shape of what is merged in
+            self.count = float(count)
+            self.mean = np.array(mean, dtype=np.float64)
+            self.m2 = np.array(m2, dtype=np.float64)
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * (count / total)
+        self.m2 += m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+
+    def merge(self, other):
+        self.merge_moments(other.count, other.mean, other.m2)
+
+    def get_state(self):
+        return {'count': np.float64(self.count), 'mean': self.mean.copy(), 'm2': self.m2.copy()}
+
+    def set_state(self, state):
+        self.count = float(state['count'])
+        self.mean = np.array(state['mean'], dtype=np.float64)
+        self.m2 = np.array(state['m2'], dtype=np.float64)
+
+# =====
+# Normalization
+# =====
+
+class Normalization():
+
+    # What gets normalized
+    observations = True
+    rewards = True
+
+    # Results are clipped to [-clip, clip]
+    clip_observations = 10.0
+    clip_rewards = 10.0
+    gamma = 0.99 # discount of the return whose deviation scales rewards
+    epsilon = 1e-8
+
+    # Frozen = statistics are used but no longer updated (evaluation)
+    frozen = False
+
+    obs_stats = None
+    return_stats = None
+    returns = None # discounted return of every env's current episode
+
+    def __init__(self, observations=True, rewards=True, clip_observations=10.0,
+                 clip_rewards=10.0, gamma=0.99, epsilon=1e-8, frozen=False):
+        self.observations = observations
+        self.rewards = rewards
+        self.clip_observations = clip_observations
+        self.clip_rewards = clip_rewards
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.frozen = frozen
+        self.obs_stats = RunningStats()
+        self.return_stats = RunningStats()
+
+    # Size the statistics for num_envs envs with obs_dim observations
+    def setup(self, num_envs, obs_dim):
+        if self.obs_stats.count == 0:
+            self.obs_stats = RunningStats(obs_dim)
+        self.returns = np.zeros(num_envs)
+
+    def freeze(self, frozen=True):
+        self.frozen = frozen
+
+    # Normalize observations (rows of raw values) in place
+    def normalize_observations(self, observations):
+        if not self.observations:
+            return observations
+        if not self.frozen:
+            self.obs_stats.update(observations)
+        return self.scale_observations(observations)
+
+    # Normalize observations in place with the current statistics, without
+    # updating them
+    def scale_observations(self, observations):
+        observations -= self.obs_stats.mean
+        observations /= np.sqrt(self.obs_stats.var + self.epsilon)
+        np.clip(observations, -self.clip_observations, self.clip_observations, out=observations)
+        return observations
+
+    # Scale rewards (raw values of the envs at indices) in place
+    def normalize_rewards(self, rewards, dones, indices=None):
+        if not self.rewards:
+            return rewards
+        if indices is None:
+            returns = self.returns
+            returns *= self.gamma
+            returns += rewards
+        else:
+            returns = self.returns[indices] * self.gamma + rewards
+            self.returns[indices] = returns
+        if not self.frozen:
+            self.return_stats.update(returns)
+        self.scale_rewards(rewards)
+
+        # Episodes that ended start their return over
+        if indices is None:
+            self.returns[dones] = 0.0
+        else:
+            self.returns[np.asarray(indices)[dones]] = 0.0
+        return rewards
+
+    # Scale rewards in place with the current statistics, without updating
+    # them
+    def scale_rewards(self, rewards):
+        rewards /= np.sqrt(self.return_stats.var + self.epsilon)
+        np.clip(rewards, -self.clip_rewards, self.clip_rewards, out=rewards)
+        return rewards
+
+    # A batch of raw transitions (e.g. sampled from a replay buffer, which
+    # stores raw values) normalized with the current statistics, as a new
+    # dict of new arrays. The statistics are not updated.
+    def apply(self, batch):
+        batch = dict(batch)
+        if self.observations:
+            for key in ('observations', 'next_observations'):
+                batch[key] = self.scale_observations(np.array(batch[key], dtype=np.float64))
+        if self.rewards:
+            batch['rewards'] = self.scale_rewards(np.array(batch['rewards'], dtype=np.float64))
+        return batch
+
+    def reset_returns(self, indices=None):
+        if indices is None:
+            self.returns[:] = 0.0
+        else:
+            self.returns[list(indices)] = 0.0
+
+    # Fold in statistics gathered elsewhere (another Normalization or its
+    # get_state()), e.g. from worker processes
+    def merge(self, other):
+        if isinstance(other, Normalization):
+            other = other.get_state()
+        self.obs_stats.merge_moments(other['obs_count'], other['obs_mean'], other['obs_m2'])
+        self.return_stats.merge_moments(other['return_count'], other['return_mean'], other['return_m2'])
+
+    # Statistics as a flat dict of arrays (np.savez-able)
+    def get_state(self):
+        state = {}
+        for prefix, stats in (('obs_', self.obs_stats), ('return_', self.return_stats)):
+            for key, value in stats.get_state().items():
+                state[prefix + key] = value
+        return state
+
+    def set_state(self, state):
+        for prefix, stats in (('obs_', self.obs_stats), ('return_', self.return_stats)):
+            stats.set_state({key: state[prefix + key] for key in ('count', 'mean', 'm2')})
+
+# Normalization from a Normalization, True (the defaults), a dict of
+# arguments or None/False (off)
+def make(normalization):
+    if normalization is None or normalization is False:
+        return None
+    if normalization is True:
+        return Normalization()
+    if isinstance(normalization, Normalization):
+        return normalization
+    return Normalization(**normalization)
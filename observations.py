@@ -0,0 +1,282 @@
+'''
+
+This compiles observation specs: which bodies and joints a Uniped observes,
+which of their quantities, and in which reference frame. A spec is compiled
+once into a flat gather plan (one small function per requested quantity);
+on reset the plan is bound to the new Box2D bodies/joints, and every step it
+writes straight into a preallocated array.
+
+'''
+
+import math
+
+import numpy as np
+
+import engine
+
+BODY_FIELDS = ('position', 'angle', 'lin_vel', 'ang_vel')
+JOINT_FIELDS = ('motor_speed', 'angle', 'translation', 'speed', 'reaction_force')
+
+# Reference frames for body quantities:
+#   relative_x - x relative to the frame body, everything else as in the world
+#   world      - x from the robot's spawn point (origin shifts included), y up
+#   body       - positions and velocities rotated into the frame body's
+#                frame, positions and angles relative to it
+FRAMES = ('relative_x', 'world', 'body')
+
+# What Uniped has always observed: every body but the foot with x relative to
+# the body, and the motor speed of every joint but the foot weld
+DEFAULT_SPEC = {
+    'bodies': None,
+    'body_fields': BODY_FIELDS,
+    'frame': 'relative_x',
+    'frame_body': 'body',
+    'joints': None,
+    'joint_fields': ('motor_speed',)
+}
+
+# =====
+# Gather functions: (handle, out, slot, ref) where ref is
+# [x, y, angle, cos, sin, world x shift] of the frame body
+# =====
+
+def position_relative_x(body, out, i, ref):
+    position = body.position
+    out[i] = position[0] - ref[0]
+    out[i + 1] = position[1]
+
+def position_world(body, out, i, ref):
+    position = body.position
+    out[i] = position[0] + ref[5]
+    out[i + 1] = position[1]
+
+def position_body(body, out, i, ref):
+    position = body.position
+    dx = position[0] - ref[0]
+    dy = position[1] - ref[1]
+    out[i] = ref[3] * dx + ref[4] * dy
+    out[i + 1] = -ref[4] * dx + ref[3] * dy
+
+def angle_world(body, out, i, ref):
+    out[i] = body.angle
+
+def angle_body(body, out, i, ref):
+    out[i] = body.angle - ref[2]
+
+def lin_vel_world(body, out, i, ref):
+    velocity = body.linearVelocity
+    out[i] = velocity[0]
+    out[i + 1] = velocity[1]
+
+def lin_vel_body(body, out, i, ref):
+    velocity = body.linearVelocity
+    out[i] = ref[3] * velocity[0] + ref[4] * velocity[1]
+    out[i + 1] = -ref[4] * velocity[0] + ref[3] * velocity[1]
+
+def ang_vel(body, out, i, ref):
+    out[i] = body.angularVelocity
+
+# All of BODY_FIELDS in one call, the common case
+def body_relative_x(body, out, i, ref):
+    position = body.position
+    velocity = body.linearVelocity
+    out[i:i + 6] = (
+        position[0] - ref[0], position[1], body.angle,
+        velocity[0], velocity[1], body.angularVelocity
+    )
+
+def body_world(body, out, i, ref):
+    position = body.position
+    velocity = body.linearVelocity
+    out[i:i + 6] = (
+        position[0] + ref[5], position[1], body.angle,
+        velocity[0], velocity[1], body.angularVelocity
+    )
+
+def joint_motor_speed(joint, out, i, ref):
+    out[i] = joint.motorSpeed
+
+def joint_angle(joint, out, i, ref):
+    out[i] = joint.angle
+
+def joint_translation(joint, out, i, ref):
+    out[i] = joint.translation
+
+def joint_speed(joint, out, i, ref):
+    out[i] = joint.speed
+
+def joint_reaction_force(joint, out, i, ref):
+    force = joint.GetReactionForce(1.0 / engine.TIME_STEP)
+    out[i] = force[0]
+    out[i + 1] = force[1]
+
+def zero(handle, out, i, ref):
+    out[i] = 0
+
+# (function, width) per field and frame
+BODY_GATHERS = {
+    'position': {
+        'relative_x': (position_relative_x, 2),
+        'world': (position_world, 2),
+        'body': (position_body, 2)
+    },
+    'angle': {
+        'relative_x': (angle_world, 1),
+        'world': (angle_world, 1),
+        'body': (angle_body, 1)
+    },
+    'lin_vel': {
+        'relative_x': (lin_vel_world, 2),
+        'world': (lin_vel_world, 2),
+        'body': (lin_vel_body, 2)
+    },
+    'ang_vel': {
+        'relative_x': (ang_vel, 1),
+        'world': (ang_vel, 1),
+        'body': (ang_vel, 1)
+    }
+}
+
+# Single function for all of BODY_FIELDS, per frame
+BODY_FUSED = {
+    'relative_x': body_relative_x,
+    'world': body_world
+}
+
+# (function, width) per field and joint type; quantities a joint type does
+# not have read as 0, so the layout does not depend on the joint types
+JOINT_GATHERS = {
+    'motor_speed': {'revolute': joint_motor_speed, 'prismatic': joint_motor_speed},
+    'angle': {'revolute': joint_angle},
+    'translation': {'prismatic': joint_translation},
+    'speed': {'revolute': joint_speed, 'prismatic': joint_speed},
+    'reaction_force': {
+        'revolute': joint_reaction_force, 'prismatic': joint_reaction_force,
+        'weld': joint_reaction_force, 'rope': joint_reaction_force
+    }
+}
+JOINT_WIDTHS = {'reaction_force': 2}
+
+# =====
+# Plans
+# =====
+
+def field_names(name, field, width):
+    if width == 1:
+        return [name + '.' + field]
+    return [name + '.' + field + '.' + axis for axis in 'xy'[:width]]
+
+class ObservationPlan():
+
+    # Compiled: (function, 'body'/'joint', name, slot, width) per gathered
+    # quantity
+    ops = None
+    names = None # one name per observation entry
+    size = 0 # gathered entries
+    frame_body = 'body'
+
+    # Bound to a built robot (see bind)
+    bound = None
+    ref_body = None
+    eng = None
+    prefix = ''
+    offset_x = 0
+    versions = None
+
+    # Preallocated output (size plus extra trailing entries for the caller)
+    out = None
+    ref = None
+
+    def __init__(self, spec, objects, joints, extra=0):
+        spec = dict(DEFAULT_SPEC, **(spec or {}))
+        body_names = sorted(obj['name'] for obj in objects)
+        joint_types = {joint['name']: joint['joint_type'] for joint in joints}
+
+        bodies = spec['bodies']
+        if bodies is None:
+            bodies = [name for name in body_names if name != 'foot']
+        elif bodies == '*':
+            bodies = body_names
+        joint_names = spec['joints']
+        if joint_names is None:
+            joint_names = [name for name in sorted(joint_types) if name != 'joint_bottom']
+        elif joint_names == '*':
+            joint_names = sorted(joint_types)
+
+        frame = spec['frame']
+        if frame not in FRAMES:
+            raise ValueError('Observation error: unknown frame ' + str(frame))
+        if spec['frame_body'] not in body_names:
+            raise ValueError('Observation error: unknown frame body ' + str(spec['frame_body']))
+        self.frame_body = spec['frame_body']
+
+        self.ops = []
+        self.names = []
+        for name in bodies:
+            if name not in body_names:
+                raise ValueError('Observation error: unknown body ' + str(name))
+            if tuple(spec['body_fields']) == BODY_FIELDS and frame in BODY_FUSED:
+                names = []
+                for field in BODY_FIELDS:
+                    names += field_names(name, field, BODY_GATHERS[field][frame][1])
+                self.add(BODY_FUSED[frame], 'body', name, names)
+                continue
+            for field in spec['body_fields']:
+                if field not in BODY_GATHERS:
+                    raise ValueError('Observation error: unknown body field ' + str(field))
+                fn, width = BODY_GATHERS[field][frame]
+                self.add(fn, 'body', name, field_names(name, field, width))
+        for name in joint_names:
+            if name not in joint_types:
+                raise ValueError('Observation error: unknown joint ' + str(name))
+            for field in spec['joint_fields']:
+                if field not in JOINT_GATHERS:
+                    raise ValueError('Observation error: unknown joint field ' + str(field))
+                fn = JOINT_GATHERS[field].get(joint_types[name], zero)
+                self.add(fn, 'joint', name, field_names(name, field, JOINT_WIDTHS.get(field, 1)))
+
+        self.out = np.zeros(self.size + extra)
+        self.ref = [0.0] * 6
+
+    def add(self, fn, kind, name, names):
+        self.ops.append((fn, kind, name, self.size, len(names)))
+        self.names += names
+        self.size += len(names)
+
+    # Resolve the Box2D handles of the robot built in eng under prefix.
+    # Bodies/joints that are gone (e.g. joints removed from the keyboard)
+    # read as 0.
+    def bind(self, eng, prefix='', offset_x=0):
+        self.eng = eng
+        self.prefix = prefix
+        self.offset_x = offset_x
+        self.ref_body = eng.bodies[prefix + self.frame_body]
+        self.bound = []
+        for fn, kind, name, slot, width in self.ops:
+            handle = (eng.bodies if kind == 'body' else eng.joints).get(prefix + name)
+            if handle is None or fn is zero:
+                self.bound += [(zero, None, slot + k) for k in range(width)]
+            else:
+                self.bound.append((fn, handle, slot))
+        self.versions = (eng.bodies.version, eng.joints.version)
+
+    def gather(self):
+        eng = self.eng
+        if self.versions != (eng.bodies.version, eng.joints.version):
+            self.bind(eng, self.prefix, self.offset_x)
+
+        body = self.ref_body
+        position = body.position
+        angle = body.angle
+        ref = self.ref
+        ref[0] = position[0]
+        ref[1] = position[1]
+        ref[2] = angle
+        ref[3] = math.cos(angle)
+        ref[4] = math.sin(angle)
+        ref[5] = eng.origin_x - self.offset_x
+
+        out = self.out
+        for fn, handle, slot in self.bound:
+            fn(handle, out, slot, ref)
+        return out
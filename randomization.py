@@ -0,0 +1,93 @@
+'''
+
+This randomizes the physics of a freshly built Uniped in place: fixture
+friction and density, joint motor limits, ground friction and gravity are
+drawn from declared ranges and written straight into the existing Box2D
+fixtures, bodies and joints (no rebuild)
+
+'''
+
+import Box2D.b2 as b2
+
+class Randomization():
+
+    # Ranges as (low, high), None = not randomized. friction, density and
+    # motor_limit are scale factors on the morphology's own values (drawn
+    # per body/joint); ground_friction and gravity (vertical, so negative)
+    # are absolute.
+    friction = None
+    density = None
+    motor_limit = None
+    ground_friction = None
+    gravity = None
+
+    def __init__(self, friction=None, density=None, motor_limit=None,
+                 ground_friction=None, gravity=None):
+        self.friction = friction
+        self.density = density
+        self.motor_limit = motor_limit
+        self.ground_friction = ground_friction
+        self.gravity = gravity
+
+    # Draw n samples at once: a dict of arrays with a leading axis of n
+    def sample(self, rng, num_bodies, num_joints, n=1):
+        batch = {}
+        if self.friction is not None:
+            batch['friction'] = rng.uniform(self.friction[0], self.friction[1], (n, num_bodies))
+        if self.density is not None:
+            batch['density'] = rng.uniform(self.density[0], self.density[1], (n, num_bodies))
+        if self.motor_limit is not None:
+            batch['motor_limit'] = rng.uniform(self.motor_limit[0], self.motor_limit[1], (n, num_joints))
+        if self.ground_friction is not None:
+            batch['ground_friction'] = rng.uniform(self.ground_friction[0], self.ground_friction[1], n)
+        if self.gravity is not None:
+            batch['gravity'] = rng.uniform(self.gravity[0], self.gravity[1], n)
+        return batch
+
+    # Sample i of a batch
+    def unbatch(self, batch, i):
+        return {key: values[i] for key, values in batch.items()}
+
+    # Write sample into the bodies/joints plan built in eng (under prefix).
+    # Values are scaled from the plan's definitions, so applying again on
+    # already randomized bodies does not compound. world=False leaves the
+    # ground and gravity alone (robots sharing a world).
+    def apply(self, eng, plan, sample, prefix='', world=True):
+        friction = sample.get('friction')
+        density = sample.get('density')
+        if friction is not None or density is not None:
+            for i, (name, body_def, position, fixtures, collision_filter, color) in enumerate(plan.bodies):
+                body = eng.bodies[prefix + name]
+                # Box2D keeps the newest fixture first
+                for fixture, (fixture_def, shape) in zip(reversed(body.fixtures), fixtures):
+                    if friction is not None:
+                        fixture.friction = fixture_def.friction * friction[i]
+                    if density is not None:
+                        fixture.density = fixture_def.density * density[i]
+                if density is not None:
+                    body.ResetMassData()
+
+        motor_limit = sample.get('motor_limit')
+        if motor_limit is not None:
+            for i, (name, obj1_name, obj2_name, joint_def) in enumerate(plan.joints):
+                joint = eng.joints[prefix + name]
+                if isinstance(joint_def, b2.revoluteJointDef):
+                    joint.maxMotorTorque = joint_def.maxMotorTorque * motor_limit[i]
+                elif isinstance(joint_def, b2.prismaticJointDef):
+                    joint.maxMotorForce = joint_def.maxMotorForce * motor_limit[i]
+
+        if world:
+            if 'ground_friction' in sample:
+                if eng.terrain is not None:
+                    eng.terrain.set_friction(float(sample['ground_friction']))
+                else:
+                    for fixture in eng.bodies['ground'].fixtures:
+                        fixture.friction = float(sample['ground_friction'])
+            if 'gravity' in sample:
+                eng.world.gravity = (0, float(sample['gravity']))
+
+# Randomization from a Randomization, a dict of ranges or None
+def make(randomization):
+    if randomization is None or isinstance(randomization, Randomization):
+        return randomization
+    return Randomization(**randomization)
@@ -0,0 +1,309 @@
+'''
+
+This is a fixed-capacity ring buffer of transitions (observation, action,
+reward, next observation, done) held in contiguous NumPy arrays, which a
+Uniped or VectorUniped given replay= writes into as it steps. Optionally the
+arrays live in shared memory, so learner processes attach() to the buffer
+and sample while the actor process writes.
+
+Transitions from different envs (streams) are interleaved; every transition
+links to the next one of its stream, which is what n-step sampling follows.
+There is one writer: the process that created the buffer.
+
+'''
+
+import numpy as np
+
+# Per-transition arrays: (name, dtype, shape without the capacity axis)
+def fields(obs_dim):
+    return [
+        ('observations', np.float32, (obs_dim,)),
+        ('actions', np.int64, ()),
+        ('rewards', np.float32, ()),
+        ('next_observations', np.float32, (obs_dim,)),
+        ('dones', np.bool_, ()),
+        # Global write count of the transition in the slot (-1 = being written)
+        ('stamps', np.int64, ()),
+        # Write count of the next transition of the same stream (-1 = none yet)
+        ('successors', np.int64, ())
+    ]
+
+# Header: transitions written, transitions reserved (written + the ones
+# being written), then the last transition of every stream
+COUNT = 0
+RESERVED = 1
+STREAMS = 2
+
+def layout(capacity, obs_dim, num_streams):
+    arrays = [('header', np.int64, (STREAMS + num_streams,))]
+    arrays += [(name, dtype, (capacity,) + shape) for name, dtype, shape in fields(obs_dim)]
+    offsets, offset = [], 0
+    for name, dtype, shape in arrays:
+        offsets.append((name, dtype, shape, offset))
+        offset += int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+        offset = (offset + 7) // 8 * 8
+    return offsets, offset
+
+class ReplayBuffer():
+
+    capacity = 0
+    obs_dim = 0
+    num_streams = 1 # envs writing into the buffer (transitions are linked per stream)
+
+    # Transition arrays (capacity rows each), see fields()
+    observations = None
+    actions = None
+    rewards = None
+    next_observations = None
+    dones = None
+    stamps = None
+    successors = None
+
+    header = None
+    memory = None # SharedMemory if shared
+    owner = True # created (and writes) the buffer, as opposed to attached
+
+    # shared: in shared memory (named name, or a generated name); create=False
+    # attaches to an existing shared buffer (see attach)
+    def __init__(self, capacity, obs_dim, num_streams=1, shared=False, name=None, create=True):
+        self.capacity = capacity
+        self.obs_dim = obs_dim
+        self.num_streams = num_streams
+        self.owner = create
+
+        offsets, size = layout(capacity, obs_dim, num_streams)
+        if shared or not create:
+            # Python 3.8+, so only imported when asked for
+            from multiprocessing import shared_memory
+            self.memory = shared_memory.SharedMemory(name, create=create, size=size)
+            buf = self.memory.buf
+        else:
+            buf = bytearray(size)
+        for field, dtype, shape, offset in offsets:
+            setattr(self, field, np.ndarray(shape, dtype, buf, offset))
+
+        if self.owner:
+            self.header[COUNT] = 0
+            self.header[RESERVED] = 0
+            self.header[STREAMS:] = -1
+            self.stamps[:] = -1
+            self.successors[:] = -1
+
+    @property
+    def name(self):
+        return self.memory.name if self.memory is not None else None
+
+    # Transitions written so far (the last capacity of them are held)
+    @property
+    def count(self):
+        return int(self.header[COUNT])
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # ===== Writing =====
+
+    def add(self, observation, action, reward, next_observation, done, stream=0):
+        count = int(self.header[COUNT])
+        slot = count % self.capacity
+        self.header[RESERVED] = count + 1
+        self.stamps[slot] = -1
+        self.observations[slot] = observation
+        self.actions[slot] = -1 if action is None else action
+        self.rewards[slot] = reward
+        self.next_observations[slot] = next_observation
+        self.dones[slot] = done
+        self.successors[slot] = -1
+        self.link(self.header[STREAMS + stream], count)
+        self.header[STREAMS + stream] = -1 if done else count
+        self.stamps[slot] = count
+        self.header[COUNT] = count + 1
+
+    # Batched writes in two halves, so a vector env can copy its observations
+    # in before stepping and the results after, straight from its arrays.
+    # Returns the write counts of the transitions.
+    def reserve(self, observations):
+        count = int(self.header[COUNT])
+        ids = np.arange(count, count + len(observations))
+        slots = ids % self.capacity
+        self.header[RESERVED] = count + len(observations)
+        self.stamps[slots] = -1
+        self.observations[slots] = observations
+        return ids
+
+    def commit(self, ids, streams, actions, rewards, next_observations, dones):
+        if len(ids) == 0:
+            return
+        slots = ids % self.capacity
+        self.actions[slots] = actions
+        self.rewards[slots] = rewards
+        self.next_observations[slots] = next_observations
+        self.dones[slots] = dones
+        self.successors[slots] = -1
+
+        streams = STREAMS + np.asarray(streams)
+        previous = self.header[streams]
+        linked = previous >= 0
+        linked[linked] = self.stamps[previous[linked] % self.capacity] == previous[linked]
+        self.successors[previous[linked] % self.capacity] = ids[linked]
+        self.header[streams] = np.where(dones, -1, ids)
+
+        self.stamps[slots] = ids
+        self.header[COUNT] = ids[-1] + 1
+
+    # Link the transition previous (write count, if still held) to next
+    def link(self, previous, following):
+        if previous >= 0:
+            slot = previous % self.capacity
+            if self.stamps[slot] == previous:
+                self.successors[slot] = following
+
+    # The next transition of stream starts a new chain (e.g. after a reset)
+    def end_stream(self, stream):
+        self.header[STREAMS + stream] = -1
+
+    # ===== Sampling =====
+
+    # Write counts that can be sampled: [oldest, count), leaving out the
+    # slots a write in progress is reusing
+    def sample_range(self):
+        count = int(self.header[COUNT])
+        oldest = max(0, int(self.header[RESERVED]) - self.capacity)
+        return oldest, count
+
+    # Write counts of batch_size transitions drawn uniformly from those held
+    def sample_ids(self, batch_size, rng=None):
+        rng = np.random if rng is None else rng
+        oldest, count = self.sample_range()
+        if count <= oldest:
+            raise ValueError('Replay error: buffer is empty')
+        return rng.randint(oldest, count, batch_size)
+
+    # Gather transitions ids with gather(ids) -> (batch, valid). Rows whose
+    # slots the writer reused while they were copied (stamps no longer
+    # matching, checked after the copy) are drawn again.
+    def draw(self, batch_size, rng, gather):
+        rng = np.random if rng is None else rng
+        ids = self.sample_ids(batch_size, rng)
+        batch, valid = gather(ids)
+        while not valid.all():
+            redo = np.flatnonzero(~valid)
+            ids[redo] = self.sample_ids(len(redo), rng)
+            redone, valid[redo] = gather(ids[redo])
+            for key, values in redone.items():
+                batch[key][redo] = values
+        return batch
+
+    def gather(self, ids):
+        slots = ids % self.capacity
+        batch = {
+            'observations': self.observations[slots],
+            'actions': self.actions[slots],
+            'rewards': self.rewards[slots],
+            'next_observations': self.next_observations[slots],
+            'dones': self.dones[slots]
+        }
+        return batch, self.stamps[slots] == ids
+
+    # Uniformly drawn transitions as a dict of gathered arrays, or (views=True)
+    # views of a random run of consecutive slots, without copying. Views are
+    # the buffer's own memory: copy what has to outlive later writes.
+    def sample(self, batch_size, rng=None, views=False):
+        if not views:
+            return self.draw(batch_size, rng, self.gather)
+
+        # Runs of write counts that sit in consecutive slots (the held range
+        # wraps around the end of the arrays at most once)
+        rng = np.random if rng is None else rng
+        oldest, count = self.sample_range()
+        wrap = (oldest // self.capacity + 1) * self.capacity
+        runs = [(start, end - start - batch_size + 1) for start, end in
+                ((oldest, min(count, wrap)), (wrap, count))]
+        runs = [(start, choices) for start, choices in runs if choices > 0]
+        if not runs:
+            raise ValueError('Replay error: no %d consecutive transitions held' % batch_size)
+        choices = np.array([choices for start, choices in runs])
+        k = rng.choice(len(runs), p=choices / choices.sum())
+        start = (runs[k][0] + rng.randint(runs[k][1])) % self.capacity
+        index = slice(start, start + batch_size)
+        return {
+            'observations': self.observations[index],
+            'actions': self.actions[index],
+            'rewards': self.rewards[index],
+            'next_observations': self.next_observations[index],
+            'dones': self.dones[index]
+        }
+
+    # Transitions of n steps: rewards summed with discount gamma along the
+    # stream until done (or the stream's chain ends), the next observation
+    # after the last step, and 'discounts' = gamma ** steps taken, for
+    # bootstrapping
+    def sample_n_step(self, batch_size, n, gamma=0.99, rng=None):
+        return self.draw(batch_size, rng, lambda ids: self.gather_n_step(ids, n, gamma))
+
+    def gather_n_step(self, ids, n, gamma):
+        slots = ids % self.capacity
+        observations = self.observations[slots]
+        actions = self.actions[slots]
+        rewards = self.rewards[slots].astype(np.float64)
+        dones = self.dones[slots].copy()
+        discounts = np.full(len(ids), gamma)
+        last_ids = ids.copy()
+
+        active = ~dones
+        for _ in range(n - 1):
+            following = self.successors[last_ids % self.capacity]
+            active &= following >= 0
+            if not active.any():
+                break
+            slot = following % self.capacity
+            step_rewards = self.rewards[slot]
+            step_dones = self.dones[slot]
+            # A successor overwritten (or being overwritten) ends the chain
+            active &= self.stamps[slot] == following
+            rewards[active] += discounts[active] * step_rewards[active]
+            discounts[active] *= gamma
+            dones[active] = step_dones[active]
+            last_ids = np.where(active, following, last_ids)
+            active &= ~dones
+
+        next_observations = self.next_observations[last_ids % self.capacity]
+        valid = (self.stamps[slots] == ids) & (self.stamps[last_ids % self.capacity] == last_ids)
+        batch = {
+            'observations': observations,
+            'actions': actions,
+            'rewards': rewards,
+            'next_observations': next_observations,
+            'dones': dones,
+            'discounts': discounts
+        }
+        return batch, valid
+
+    def close(self):
+        if self.memory is not None:
+            # The arrays are views of the shared block: drop them first
+            for field, dtype, shape in fields(0):
+                setattr(self, field, None)
+            self.header = None
+            self.memory.close()
+            if self.owner:
+                self.memory.unlink()
+            self.memory = None
+
+# A shared ReplayBuffer created by another process (by its name), for
+# sampling
+def attach(name, capacity, obs_dim, num_streams=1):
+    return ReplayBuffer(capacity, obs_dim, num_streams, name=name, create=False)
+
+# ReplayBuffer from a ReplayBuffer, a capacity, a dict of ReplayBuffer
+# arguments or None (no replay)
+def make(replay, obs_dim, num_streams=1):
+    if replay is None or isinstance(replay, ReplayBuffer):
+        if replay is not None and (replay.obs_dim != obs_dim or replay.num_streams < num_streams):
+            raise ValueError('Replay error: buffer holds %d streams of %d observations, %d of %d needed' % (
+                replay.num_streams, replay.obs_dim, num_streams, obs_dim
+            ))
+        return replay
+    if isinstance(replay, dict):
+        return ReplayBuffer(obs_dim=obs_dim, num_streams=num_streams, **replay)
+    return ReplayBuffer(int(replay), obs_dim, num_streams)
@@ -0,0 +1,200 @@
+'''
+
+This compiles reward shaping: a reward is a weighted sum of named terms
+(forward progress, upright bonus, foot below body, energy, ...) declared as
+a list. A Reward reads only the state fields its terms need; a VectorUniped
+gathers those fields for all of its envs into one array and evaluates every
+term as a NumPy expression over the whole batch.
+
+'''
+
+import numpy as np
+
+import engine
+
+# =====
+# Fields: (env) -> float, read straight from the robot's Box2D bodies/joints
+# =====
+
+def body_y(env, name):
+    body = env.eng.bodies.get(env.prefix + name)
+    return body.position[1] if body is not None else 0.0
+
+# Distance made since the last step (also moves the env's reference point,
+# so it is gathered exactly once per step)
+def field_progress(env):
+    body = env.eng.bodies[env.prefix + 'body']
+    x = body.position[0] + env.eng.origin_x - env.offset[0]
+    delta = x - env.prev_dist
+    env.prev_dist = x
+    return delta
+
+def field_distance(env):
+    return env.eng.bodies[env.prefix + 'body'].position[0] + env.eng.origin_x - env.offset[0]
+
+def field_body_y(env):
+    return body_y(env, 'body')
+
+def field_head_y(env):
+    return body_y(env, 'head')
+
+def field_foot_y(env):
+    return body_y(env, 'foot')
+
+def field_body_y_vel(env):
+    return env.eng.bodies[env.prefix + 'body'].linearVelocity[1]
+
+def field_body_angle(env):
+    return env.eng.bodies[env.prefix + 'body'].angle
+
+# Mechanical power of all joint motors, |torque * speed| summed
+def field_power(env):
+    inv_dt = 1.0 / engine.TIME_STEP
+    power = 0.0
+    for name in env.joint_names:
+        joint = env.eng.joints.get(env.prefix + name)
+        if joint is None or not getattr(joint, 'motorEnabled', False):
+            continue
+        if hasattr(joint, 'GetMotorTorque'):
+            power += abs(joint.GetMotorTorque(inv_dt) * joint.speed)
+        else:
+            power += abs(joint.GetMotorForce(inv_dt) * joint.speed)
+    return power
+
+# Same test as Uniped._done_hit_ground
+def field_fallen(env):
+    for name in ('body', 'head'):
+        body = env.eng.bodies.get(env.prefix + name)
+        if body is not None and (body.userData.get('hit_ground') or body.position[1] <= 0):
+            return 1.0
+    return 0.0
+
+FIELDS = {
+    'progress': field_progress,
+    'distance': field_distance,
+    'body_y': field_body_y,
+    'head_y': field_head_y,
+    'foot_y': field_foot_y,
+    'body_y_vel': field_body_y_vel,
+    'body_angle': field_body_angle,
+    'power': field_power,
+    'fallen': field_fallen
+}
+
+# =====
+# Terms: (fields) -> value. Only arithmetic, comparisons and NumPy ufuncs, so
+# the same expression works on floats (one env) and arrays (a batch).
+# =====
+
+def term_progress(f):
+    return f['progress']
+
+def term_distance(f):
+    return f['distance']
+
+def term_rising(f):
+    return np.maximum(f['body_y_vel'], 0.0)
+
+def term_falling(f):
+    return f['body_y_vel'] < 0.0
+
+def term_upright(f):
+    return np.cos(f['body_angle'])
+
+def term_head_above_body(f):
+    return f['head_y'] > f['body_y']
+
+def term_foot_below_body(f):
+    return f['foot_y'] < f['body_y']
+
+def term_energy(f):
+    return f['power']
+
+def term_alive(f):
+    return 1.0
+
+# name -> (fields read, expression)
+TERMS = {
+    'progress': (('progress',), term_progress),
+    'distance': (('distance',), term_distance),
+    'rising': (('body_y_vel',), term_rising),
+    'falling': (('body_y_vel',), term_falling),
+    'upright': (('body_angle',), term_upright),
+    'head_above_body': (('head_y', 'body_y'), term_head_above_body),
+    'foot_below_body': (('foot_y', 'body_y'), term_foot_below_body),
+    'energy': (('power',), term_energy),
+    'alive': ((), term_alive)
+}
+
+# What Uniped has always been rewarded with
+DEFAULT_TERMS = [('progress', 0.8)]
+FALL_PENALTY = -1.0
+
+# =====
+# Rewards
+# =====
+
+class Reward():
+
+    # [(name, weight, expression)]
+    terms = None
+    # Reward for a step that ends with the body or head on the ground,
+    # replacing the terms
+    fall_penalty = FALL_PENALTY
+
+    # Fields the terms read, in gather order ('fallen' always first)
+    fields = None
+    gathers = None
+
+    # terms: [(name, weight)] or {name: weight}
+    def __init__(self, terms=DEFAULT_TERMS, fall_penalty=FALL_PENALTY):
+        if isinstance(terms, dict):
+            terms = list(terms.items())
+        self.terms = []
+        self.fields = ['fallen']
+        for name, weight in terms:
+            if name not in TERMS:
+                raise ValueError('Reward error: unknown term ' + str(name))
+            fields, expression = TERMS[name]
+            self.terms.append((name, float(weight), expression))
+            self.fields += [field for field in fields if field not in self.fields]
+        self.fall_penalty = fall_penalty
+        self.gathers = [FIELDS[field] for field in self.fields]
+
+    def gather(self, env):
+        return {field: gather(env) for field, gather in zip(self.fields[1:], self.gathers[1:])}
+
+    # Reward of one env for the step it just took. Every field is gathered
+    # even on a fall, as in evaluate_batch, so fields with side effects
+    # (progress) advance the same way for single and batched envs.
+    def evaluate(self, env):
+        fallen = field_fallen(env)
+        f = self.gather(env)
+        if fallen:
+            return self.fall_penalty
+        reward = 0.0
+        for name, weight, expression in self.terms:
+            reward += weight * expression(f)
+        return float(reward)
+
+    # Rewards of a batch of envs, written into out
+    def evaluate_batch(self, envs, out):
+        values = np.empty((len(self.gathers), len(envs)))
+        for j, env in enumerate(envs):
+            for k, gather in enumerate(self.gathers):
+                values[k, j] = gather(env)
+        f = dict(zip(self.fields, values))
+
+        reward = np.zeros(len(envs))
+        for name, weight, expression in self.terms:
+            reward += weight * expression(f)
+        np.copyto(out, np.where(f['fallen'] > 0, self.fall_penalty, reward))
+        return out
+
+# Reward from a Reward, a list/dict of weighted terms or None (the default)
+def make(reward):
+    if reward is None:
+        return Reward()
+    if isinstance(reward, Reward):
+        return reward
+    return Reward(reward)
@@ -0,0 +1,461 @@
+'''
+
+This runs whole Uniped episodes in rollout worker processes and ships the
+trajectories back to a learner as compressed blocks, either over a socket or
+through a spool directory.
+
+A Coordinator (used from the learner process) spawns and supervises local
+workers, accepts registrations from remote ones, pushes policy parameters
+and hands out trajectory blocks. Workers can also be started by hand:
+
+    ROLLOUT_AUTHKEY=<key in hex> python3 rollout.py kangaroo --connect host:port --worker-id 7
+    python3 rollout.py kangaroo --spool /path/to/spool --worker-id 7
+
+'''
+
+import argparse
+import glob
+import io
+import multiprocessing.connection
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+import env_client
+
+PARAMS_FILE = 'params.npz'
+
+# =====
+# Policies
+# =====
+
+# Greedy linear policy: action = argmax(weights . observation + bias)
+class LinearPolicy():
+
+    weights = None
+    bias = None
+
+    def __init__(self, params=None):
+        if params is not None:
+            self.set_params(params)
+
+    def set_params(self, params):
+        self.weights = np.asarray(params['weights'], dtype=np.float64)
+        self.bias = np.asarray(params['bias'], dtype=np.float64)
+
+    def act(self, observation):
+        if self.weights is None:
+            return None
+        return int(np.argmax(self.weights.dot(observation) + self.bias))
+
+# =====
+# Trajectory blocks
+# =====
+
+def encode_arrays(arrays):
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **arrays)
+    return buf.getvalue()
+
+def decode_arrays(data):
+    with np.load(io.BytesIO(data)) as arrays:
+        return {key: arrays[key] for key in arrays.files}
+
+# Run one episode and return it as a block of arrays. 'dones' are as the env
+# reported them; 'truncated' says the episode was cut off (by max_steps, or
+# by the env's time limit/stall detectors, see info['truncated']) rather
+# than terminated, so its last observation should be bootstrapped from.
+def run_episode(env, policy, max_steps=None):
+    observations, actions, rewards, dones = [env._reset()], [], [], []
+    done = False
+    truncated = False
+    while not done:
+        if max_steps is not None and len(actions) >= max_steps:
+            truncated = True
+            break
+        action = policy.act(observations[-1])
+        observation, reward, done, info = env._step(action)
+        observations.append(observation)
+        actions.append(-1 if action is None else action)
+        rewards.append(reward)
+        dones.append(done)
+        if done:
+            truncated = info.get('truncated', False)
+    return {
+        'observations': np.asarray(observations, dtype=np.float32),
+        'actions': np.asarray(actions, dtype=np.int32),
+        'rewards': np.asarray(rewards, dtype=np.float32),
+        'dones': np.asarray(dones, dtype=bool),
+        'truncated': np.bool_(truncated)
+    }
+
+# =====
+# Worker
+# =====
+
+def run_worker(morphology, worker_id, connect=None, spool=None,
+               max_steps=None, max_spooled=16, authkey=None, **env_kwargs):
+    # Connections unpickle what they receive, so never a guessable key
+    if connect is not None and not authkey:
+        raise ValueError('Rollout error: socket workers need the coordinator\'s authkey')
+    import uniped
+
+    env = uniped.make(morphology, render_window=False, **env_kwargs)
+    policy = LinearPolicy()
+    if connect is not None:
+        socket_worker(env, policy, worker_id, connect, max_steps, authkey)
+    elif spool is not None:
+        spool_worker(env, policy, worker_id, spool, max_steps, max_spooled)
+    else:
+        raise ValueError('Rollout error: worker needs either a socket address or a spool directory')
+
+def make_block(block, worker_id, version, seq):
+    block['worker'] = np.int32(worker_id)
+    block['policy_version'] = np.int64(version)
+    block['seq'] = np.int64(seq)
+    return encode_arrays(block)
+
+# Sends a block for every credit the coordinator has granted
+def socket_worker(env, policy, worker_id, address, max_steps, authkey):
+    family, sockaddr = env_client.parse_address(address)
+    family = 'AF_UNIX' if family == socket.AF_UNIX else 'AF_INET'
+    conn = multiprocessing.connection.Client(sockaddr, family, authkey=authkey)
+    conn.send(('hello', worker_id, os.getpid()))
+
+    credits = 0
+    version = -1
+    seq = 0
+    try:
+        while True:
+            # Handle control messages, blocking while there is nothing to do
+            while conn.poll(0) or credits == 0 or version < 0:
+                message = conn.recv()
+                if message[0] == 'credit':
+                    credits += message[1]
+                elif message[0] == 'params':
+                    version = message[1]
+                    policy.set_params(decode_arrays(message[2]))
+                elif message[0] == 'stop':
+                    return
+
+            block = run_episode(env, policy, max_steps)
+            conn.send(('block', make_block(block, worker_id, version, seq)))
+            credits -= 1
+            seq += 1
+    except (EOFError, ConnectionError):
+        # Coordinator went away
+        pass
+    finally:
+        conn.close()
+        env._close()
+
+# Writes blocks into the spool directory while it holds fewer than max_spooled
+def spool_worker(env, policy, worker_id, spool, max_steps, max_spooled):
+    params_path = os.path.join(spool, PARAMS_FILE)
+    params_mtime = None
+    version = -1
+    seq = 0
+    # Blocks of an earlier (restarted) process of this worker may still be
+    # waiting in the spool; names carry the process too so they are never
+    # overwritten
+    incarnation = '%d-%d' % (os.getpid(), time.time_ns() // 1000000)
+    try:
+        while True:
+            # Pick up new parameters
+            try:
+                mtime = os.stat(params_path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime != params_mtime:
+                with open(params_path, 'rb') as f:
+                    params = decode_arrays(f.read())
+                version = int(params.pop('version'))
+                policy.set_params(params)
+                params_mtime = mtime
+
+            # Backpressure
+            if version < 0 or len(glob.glob(os.path.join(spool, 'block-*.npz'))) >= max_spooled:
+                time.sleep(0.05)
+                continue
+
+            block = run_episode(env, policy, max_steps)
+            name = 'block-%d-%s-%d.npz' % (worker_id, incarnation, seq)
+            tmp_path = os.path.join(spool, '.' + name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(make_block(block, worker_id, version, seq))
+            os.replace(tmp_path, os.path.join(spool, name))
+            seq += 1
+    finally:
+        env._close()
+
+# =====
+# Coordinator
+# =====
+
+class Coordinator():
+
+    # Where workers deliver blocks (exactly one of the two is set)
+    address = None
+    spool = None
+
+    # Blocks each worker may have outstanding before it must wait
+    max_inflight = 2
+
+    # Local worker processes, by worker id
+    processes = None
+    restarts = 0
+
+    # Registered (socket) workers: worker id -> connection
+    workers = None
+    # Blocks received but not yet handed out, by worker id (they count
+    # against the worker's max_inflight across reconnects)
+    outstanding = None
+
+    # Latest policy parameters
+    params = None
+    version = -1
+
+    def __init__(self, morphology, num_workers, address=None, spool=None,
+                 max_inflight=2, max_steps=None, authkey=None, restart_delay=1.0):
+        if (address is None) == (spool is None):
+            raise ValueError('Rollout error: specify exactly one of address and spool')
+        # Connections unpickle what they receive, so whoever knows the key
+        # can run code here: a fresh random key for local workers, and one
+        # shared on purpose with workers on other hosts
+        if authkey is None:
+            if address is not None and env_client.parse_address(address)[0] != socket.AF_UNIX:
+                raise ValueError('Rollout error: TCP addresses need an explicit authkey')
+            authkey = os.urandom(32)
+        self.morphology = morphology
+        self.num_workers = num_workers
+        self.address = address
+        self.spool = spool
+        self.max_inflight = max_inflight
+        self.max_steps = max_steps
+        self.authkey = authkey
+        self.restart_delay = restart_delay
+
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.blocks = queue.Queue()
+        self.workers = {}
+        self.send_locks = {}
+        self.outstanding = {}
+        self.processes = {}
+
+        if self.address is not None:
+            family, sockaddr = env_client.parse_address(address)
+            if family == socket.AF_UNIX and os.path.exists(sockaddr):
+                os.unlink(sockaddr)
+            family = 'AF_UNIX' if family == socket.AF_UNIX else 'AF_INET'
+            self.listener = multiprocessing.connection.Listener(sockaddr, family, authkey=authkey)
+            self.address = address if family == 'AF_UNIX' else '%s:%d' % self.listener.address
+            threading.Thread(target=self.accept_workers, daemon=True).start()
+        else:
+            os.makedirs(self.spool, exist_ok=True)
+
+        for worker_id in range(num_workers):
+            self.start_worker(worker_id)
+        threading.Thread(target=self.supervise, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ===== Local workers =====
+
+    def worker_command(self, worker_id):
+        command = [
+            sys.executable, os.path.abspath(__file__), self.morphology,
+            '--worker-id', str(worker_id)
+        ]
+        if self.address is not None:
+            command += ['--connect', self.address]
+        else:
+            # Spool backpressure is shared: at most max_inflight blocks per worker
+            max_spooled = self.max_inflight * self.num_workers
+            command += ['--spool', self.spool, '--max-spooled', str(max_spooled)]
+        if self.max_steps is not None:
+            command += ['--max-steps', str(self.max_steps)]
+        return command
+
+    def start_worker(self, worker_id):
+        env = dict(os.environ, ROLLOUT_AUTHKEY=self.authkey.hex())
+        self.processes[worker_id] = subprocess.Popen(
+            self.worker_command(worker_id),
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env
+        )
+
+    def supervise(self):
+        # Restart local workers that died
+        while not self.stopping.wait(self.restart_delay):
+            for worker_id, process in list(self.processes.items()):
+                if process.poll() is not None and not self.stopping.is_set():
+                    self.restarts += 1
+                    self.start_worker(worker_id)
+
+    # ===== Socket workers =====
+
+    def accept_workers(self):
+        while not self.stopping.is_set():
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                if self.stopping.is_set():
+                    return
+                continue
+            threading.Thread(target=self.serve_worker, args=(conn,), daemon=True).start()
+
+    def send(self, worker_id, message):
+        with self.lock:
+            conn = self.workers.get(worker_id)
+            send_lock = self.send_locks.get(worker_id)
+        if conn is None:
+            return
+        try:
+            with send_lock:
+                conn.send(message)
+        except (OSError, ValueError):
+            pass
+
+    def serve_worker(self, conn):
+        try:
+            hello = conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            return
+        worker_id = hello[1]
+
+        # Register, then hand out credits and the current policy. Blocks an
+        # earlier connection of this worker left unconsumed get their credit
+        # back when consumed (see get_block), so they are not granted again.
+        with self.lock:
+            old = self.workers.get(worker_id)
+            self.workers[worker_id] = conn
+            self.send_locks[worker_id] = threading.Lock()
+            params, version = self.params, self.version
+            credits = self.max_inflight - self.outstanding.get(worker_id, 0)
+        if old is not None:
+            old.close()
+        if credits > 0:
+            self.send(worker_id, ('credit', credits))
+        if params is not None:
+            self.send(worker_id, ('params', version, params))
+
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == 'block':
+                    with self.lock:
+                        self.outstanding[worker_id] = self.outstanding.get(worker_id, 0) + 1
+                    self.blocks.put((worker_id, message[1]))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self.lock:
+                if self.workers.get(worker_id) is conn:
+                    del self.workers[worker_id]
+                    del self.send_locks[worker_id]
+            conn.close()
+
+    # ===== Learner interface =====
+
+    def set_params(self, params):
+        encoded = encode_arrays(params)
+        with self.lock:
+            self.version += 1
+            self.params = encoded
+            version = self.version
+            worker_ids = list(self.workers)
+        if self.address is not None:
+            for worker_id in worker_ids:
+                self.send(worker_id, ('params', version, encoded))
+        else:
+            params = dict(params, version=np.int64(version))
+            tmp_path = os.path.join(self.spool, '.' + PARAMS_FILE + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(encode_arrays(params))
+            os.replace(tmp_path, os.path.join(self.spool, PARAMS_FILE))
+        return version
+
+    # Next trajectory block (dict of arrays), or None on timeout
+    def get_block(self, timeout=None):
+        if self.address is not None:
+            try:
+                worker_id, data = self.blocks.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            # Consuming a block frees a slot for that worker
+            with self.lock:
+                self.outstanding[worker_id] -= 1
+            self.send(worker_id, ('credit', 1))
+            return decode_arrays(data)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            paths = sorted(
+                glob.glob(os.path.join(self.spool, 'block-*.npz')),
+                key=os.path.getmtime
+            )
+            if paths:
+                with open(paths[0], 'rb') as f:
+                    data = f.read()
+                os.unlink(paths[0])
+                return decode_arrays(data)
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(0.01)
+
+    def registered_workers(self):
+        with self.lock:
+            return sorted(self.workers)
+
+    def close(self):
+        self.stopping.set()
+        with self.lock:
+            worker_ids = list(self.workers)
+        for worker_id in worker_ids:
+            self.send(worker_id, ('stop',))
+        if self.address is not None:
+            self.listener.close()
+        for process in self.processes.values():
+            if self.spool is not None:
+                # Spool workers only stop when told to by a signal
+                process.terminate()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.terminate()
+                process.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a rollout worker')
+    parser.add_argument('morphology', help='morphology module, e.g. kangaroo or pogo')
+    parser.add_argument('--worker-id', type=int, default=0)
+    parser.add_argument('--connect', help="coordinator address, 'unix:/path' or 'host:port'")
+    parser.add_argument('--spool', help='spool directory shared with the learner')
+    parser.add_argument('--max-spooled', type=int, default=16,
+                        help='pause while the spool holds this many blocks')
+    parser.add_argument('--max-steps', type=int, default=None)
+    args = parser.parse_args()
+
+    authkey = os.environ.get('ROLLOUT_AUTHKEY')
+    if args.connect is not None and not authkey:
+        parser.error('--connect needs the coordinator\'s authkey in ROLLOUT_AUTHKEY (hex)')
+    authkey = bytes.fromhex(authkey) if authkey else None
+    try:
+        run_worker(
+            args.morphology, args.worker_id, args.connect, args.spool,
+            args.max_steps, args.max_spooled, authkey
+        )
+    except KeyboardInterrupt:
+        pass
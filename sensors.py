@@ -0,0 +1,130 @@
+'''
+
+This implements a height-scan sensor: fans of rays cast from robot bodies
+toward the ground, reporting the distance to the first ground hit of each
+
+'''
+
+import math
+
+import numpy as np
+
+# Edges of every ground polygon as (S, 2) start and end points in Box2D
+# coordinates, without the downward facing ones that a ray from above never
+# hits first. Only changes when terrain chunks come and go or the origin
+# moves (see Engine.ground_version).
+def ground_edges(eng):
+    starts, ends = [], []
+    for name in eng.bodies:
+        body = eng.bodies[name]
+        if body.userData['name'] != 'ground':
+            continue
+        cos, sin = math.cos(body.angle), math.sin(body.angle)
+        x, y = body.position
+        for fixture in body.fixtures:
+            vertices = np.array(fixture.shape.vertices, dtype=np.float64)
+            world = np.empty_like(vertices)
+            world[:, 0] = x + cos * vertices[:, 0] - sin * vertices[:, 1]
+            world[:, 1] = y + sin * vertices[:, 0] + cos * vertices[:, 1]
+            starts.append(world)
+            ends.append(np.roll(world, -1, axis=0))
+    if not starts:
+        return np.zeros((0, 2)), np.zeros((0, 2))
+    starts, ends = np.concatenate(starts), np.concatenate(ends)
+
+    # Box2D polygons wind counterclockwise, so the outward normal of an edge
+    # points down when the edge runs left to right
+    keep = ends[:, 0] - starts[:, 0] <= 1e-9
+    return starts[keep], ends[keep]
+
+class HeightScan():
+
+    # Fan of num_rays rays per origin body, spread radians wide around
+    # straight down, reporting hits up to max_distance
+    origins = ('body', 'foot')
+    num_rays = 9
+    spread = math.pi / 2
+    max_distance = 6.0
+
+    # Readings are reused until an origin moves more than this (meters) or
+    # the ground changes
+    move_threshold = 0.02
+
+    # Preallocated results: one distance per ray, origin by origin
+    readings = None
+
+    # Cache
+    edges = None
+    edge_min_x = None
+    edge_max_x = None
+    ground_version = None
+    last_positions = None
+
+    def __init__(self, origins=('body', 'foot'), num_rays=9, spread=math.pi / 2,
+                 max_distance=6.0, move_threshold=0.02):
+        self.origins = tuple(origins)
+        self.num_rays = num_rays
+        self.spread = spread
+        self.max_distance = max_distance
+        self.move_threshold = move_threshold
+
+        angles = np.linspace(-spread / 2, spread / 2, num_rays) if num_rays > 1 else np.zeros(1)
+        self.reach = max_distance * np.max(np.abs(np.sin(angles)))
+        directions = np.stack([np.sin(angles), -np.cos(angles)], axis=1)
+        self.directions = np.tile(directions, (len(self.origins), 1))
+        self.readings = np.full(len(self.origins) * num_rays, max_distance)
+        self.last_positions = np.full((len(self.origins), 2), np.inf)
+        self.ray_origins = np.zeros((len(self.origins) * num_rays, 2))
+
+    def __len__(self):
+        return len(self.readings)
+
+    # Update readings for the robot named with prefix in eng and return them
+    def scan(self, eng, prefix=''):
+        positions = np.array([eng.bodies[prefix + name].position for name in self.origins])
+
+        ground_changed = self.ground_version != eng.ground_version
+        if ground_changed:
+            self.edges = ground_edges(eng)
+            self.edge_min_x = np.minimum(self.edges[0][:, 0], self.edges[1][:, 0])
+            self.edge_max_x = np.maximum(self.edges[0][:, 0], self.edges[1][:, 0])
+            self.ground_version = eng.ground_version
+        elif np.max(np.abs(positions - self.last_positions)) < self.move_threshold:
+            return self.readings
+        self.last_positions[:] = positions
+
+        # Only edges within sideways reach of the fans
+        near = (
+            (self.edge_max_x >= positions[:, 0].min() - self.reach) &
+            (self.edge_min_x <= positions[:, 0].max() + self.reach)
+        )
+        starts, ends = self.edges[0][near], self.edges[1][near]
+        if len(starts) == 0:
+            self.readings[:] = self.max_distance
+            return self.readings
+
+        # Ray p + t d against edge a + u e for every (ray, edge) pair:
+        # t = (a - p) x e / (d x e), u = (a - p) x d / (d x e)
+        self.ray_origins[:] = np.repeat(positions, self.num_rays, axis=0)
+        d = self.directions[:, None, :]
+        e = (ends - starts)[None, :, :]
+        ap = starts[None, :, :] - self.ray_origins[:, None, :]
+        denom = d[..., 0] * e[..., 1] - d[..., 1] * e[..., 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (ap[..., 0] * e[..., 1] - ap[..., 1] * e[..., 0]) / denom
+            u = (ap[..., 0] * d[..., 1] - ap[..., 1] * d[..., 0]) / denom
+        hit = (denom != 0) & (t >= 0) & (t <= self.max_distance) & (u >= 0) & (u <= 1)
+        np.min(np.where(hit, t, self.max_distance), axis=1, out=self.readings)
+        return self.readings
+
+# HeightScan for one robot from a HeightScan (copied, since it caches that
+# robot's readings), a dict of HeightScan arguments or None
+def make(height_scan):
+    if height_scan is None:
+        return None
+    if isinstance(height_scan, HeightScan):
+        return HeightScan(
+            height_scan.origins, height_scan.num_rays, height_scan.spread,
+            height_scan.max_distance, height_scan.move_threshold
+        )
+    return HeightScan(**height_scan)
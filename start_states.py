@@ -0,0 +1,208 @@
+'''
+
+This builds and loads libraries of pre-settled start states, so episodes can
+begin from a validated resting (or mid-gait) pose instead of spending their
+first ticks dropping from the spawn height
+
+    python3 start_states.py kangaroo --count 256 --out kangaroo_starts.npz
+
+'''
+
+import argparse
+
+import numpy as np
+
+import morphology as morphology_lib
+
+# The robots cannot stand still unactuated, so a pose counts as settled once
+# the foot is on the ground and the landing has been absorbed (body vertical
+# speed below this)
+SETTLED_VERTICAL_SPEED = 1.0
+
+# =====
+# Library
+# =====
+
+class StartStateLibrary():
+
+    # Names of the bodies/joints, in array order
+    body_names = None
+    joint_names = None
+
+    # Per state: positions (N, B, 2), angles (N, B), linear velocities
+    # (N, B, 2), angular velocities (N, B) and joint motor speeds (N, J)
+    positions = None
+    angles = None
+    lin_vels = None
+    ang_vels = None
+    motor_speeds = None
+
+    # morphology.spec_hash of the spec the states were settled with (poses
+    # only hold for the same shapes, joints and collision masks)
+    spec = None
+
+    def __init__(self, body_names, joint_names, positions, angles, lin_vels, ang_vels, motor_speeds, spec=None):
+        self.body_names = list(body_names)
+        self.joint_names = list(joint_names)
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.angles = np.asarray(angles, dtype=np.float64)
+        self.lin_vels = np.asarray(lin_vels, dtype=np.float64)
+        self.ang_vels = np.asarray(ang_vels, dtype=np.float64)
+        self.motor_speeds = np.asarray(motor_speeds, dtype=np.float64)
+        self.spec = spec
+
+    def __len__(self):
+        return len(self.positions)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            body_names=np.array(self.body_names),
+            joint_names=np.array(self.joint_names),
+            positions=self.positions,
+            angles=self.angles,
+            lin_vels=self.lin_vels,
+            ang_vels=self.ang_vels,
+            motor_speeds=self.motor_speeds,
+            spec=np.array(self.spec or '')
+        )
+
+    # Make sure the library was built for this morphology
+    def validate(self, objects, joints):
+        if len(self) == 0:
+            raise ValueError('Start state error: library is empty')
+        body_names = set(obj['name'] for obj in objects)
+        joint_names = set(joint['name'] for joint in joints)
+        if set(self.body_names) != body_names or not set(self.joint_names) <= joint_names:
+            raise ValueError('Start state error: library does not match the morphology')
+        if self.spec is None:
+            raise ValueError('Start state error: library has no morphology hash (built by an older version), regenerate it')
+        if self.spec != morphology_lib.spec_hash(objects, joints):
+            raise ValueError('Start state error: library was settled with a different version of the morphology, regenerate it')
+
+    def sample(self, rng):
+        return rng.randint(len(self))
+
+    # Move freshly built bodies into state idx
+    def restore(self, eng, idx, prefix='', offset=(0, 0)):
+        positions = self.positions[idx]
+        angles = self.angles[idx]
+        lin_vels = self.lin_vels[idx]
+        ang_vels = self.ang_vels[idx]
+        for i, name in enumerate(self.body_names):
+            body = eng.bodies[prefix + name]
+            body.transform = (
+                (positions[i, 0] + offset[0], positions[i, 1] + offset[1]), angles[i]
+            )
+            body.linearVelocity = (lin_vels[i, 0], lin_vels[i, 1])
+            body.angularVelocity = ang_vels[i]
+            body.awake = True
+        for i, name in enumerate(self.joint_names):
+            eng.joints[prefix + name].motorSpeed = self.motor_speeds[idx, i]
+
+def load(path):
+    with np.load(path) as data:
+        spec = str(data['spec']) if 'spec' in data.files else ''
+        return StartStateLibrary(
+            [str(name) for name in data['body_names']],
+            [str(name) for name in data['joint_names']],
+            data['positions'],
+            data['angles'],
+            data['lin_vels'],
+            data['ang_vels'],
+            data['motor_speeds'],
+            spec or None
+        )
+
+# =====
+# Generation
+# =====
+
+def is_settled(eng):
+    foot_down = any(edge.contact.touching for edge in eng.bodies['foot'].contacts)
+    return foot_down and abs(eng.bodies['body'].linearVelocity[1]) < SETTLED_VERTICAL_SPEED
+
+def capture(eng, body_names, joint_names):
+    bodies = [eng.bodies[name] for name in body_names]
+    return (
+        [tuple(body.position) for body in bodies],
+        [body.angle for body in bodies],
+        [tuple(body.linearVelocity) for body in bodies],
+        [body.angularVelocity for body in bodies],
+        [eng.joints[name].motorSpeed for name in joint_names]
+    )
+
+# Drop the robot from its spawn pose until it settles, then optionally run
+# random actions for a random number of ticks (mid-gait states) and perturb
+# velocities. Only states where the robot is still standing are kept.
+def generate(morphology, count, max_settle_ticks=120, gait_ticks=(0, 0),
+             velocity_noise=0.0, seed=None, max_attempts=None):
+    import uniped
+
+    env = uniped.make(morphology, render_window=False)
+    env._seed(seed)
+    rng = env.np_random
+
+    body_names = sorted(obj['name'] for obj in env.objects)
+    joint_names = sorted(
+        joint['name'] for joint in env.joints if joint['joint_type'] in ('revolute', 'prismatic')
+    )
+    num_actions = min(len(env.actions), 8)
+
+    states = []
+    attempts = 0
+    max_attempts = max_attempts or 10 * count
+    while len(states) < count and attempts < max_attempts:
+        attempts += 1
+        env._reset()
+
+        # Settle
+        for _ in range(max_settle_ticks):
+            env._step(None)
+            if is_settled(env.eng):
+                break
+        else:
+            continue
+
+        # Wander into a mid-gait state
+        for _ in range(rng.randint(gait_ticks[0], gait_ticks[1] + 1)):
+            env._step(rng.randint(num_actions))
+
+        state = env._get_state()
+        if env._is_done(state):
+            continue
+
+        positions, angles, lin_vels, ang_vels, motor_speeds = capture(env.eng, body_names, joint_names)
+        if velocity_noise > 0:
+            lin_vels = np.asarray(lin_vels) + rng.normal(0, velocity_noise, (len(body_names), 2))
+            ang_vels = np.asarray(ang_vels) + rng.normal(0, velocity_noise, len(body_names))
+        states.append((positions, angles, lin_vels, ang_vels, motor_speeds))
+
+    env._close()
+    if not states:
+        raise RuntimeError('Start state error: could not produce any valid start states')
+
+    return StartStateLibrary(
+        body_names, joint_names,
+        *[np.array([state[i] for state in states]) for i in range(5)],
+        spec=morphology_lib.spec_hash(env.objects, env.joints)
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a start state library')
+    parser.add_argument('morphology', help='morphology module, e.g. kangaroo or pogo')
+    parser.add_argument('--count', type=int, default=64)
+    parser.add_argument('--out', required=True, help='output .npz file')
+    parser.add_argument('--max-settle-ticks', type=int, default=120)
+    parser.add_argument('--gait-ticks', type=int, nargs=2, default=(0, 0),
+                        metavar=('MIN', 'MAX'), help='random-action ticks after settling')
+    parser.add_argument('--velocity-noise', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    library = generate(
+        args.morphology, args.count, args.max_settle_ticks, tuple(args.gait_ticks),
+        args.velocity_noise, args.seed
+    )
+    library.save(args.out)
+    print('Saved %d start states to %s' % (len(library), args.out))
@@ -0,0 +1,289 @@
+'''
+
+This sweeps morphology parameters and control constants: every variant is
+evaluated with a fixed policy across a process pool, and the results are
+written to a table
+
+    python3 sweep.py kangaroo \
+        --param objects.foot.shape_args.friction=1,2,3.5 \
+        --param controls.FORCE=50:150:5 \
+        --workers 4 --out sweep.csv
+
+Parameters are dotted paths into the morphology:
+
+    objects.<name>.<obj_args|shape_args>.<key>[.<index>]
+    joints.<name>.joint_args.<key>[.<index>]
+    controls.<CONSTANT>
+
+A name of * changes every object/joint that has the key. Values are either a
+list (1,2,3.5) or a range: lo:hi:n for n evenly spaced values in a grid, or
+lo:hi to sample uniformly with --random.
+
+'''
+
+import argparse
+import copy
+import csv
+import itertools
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+import morphology as morphology_lib
+
+# Values the control constants of each (worker process's) morphology module
+# had before a variant changed them
+control_defaults = {}
+
+# =====
+# Parameters
+# =====
+
+class Param():
+
+    path = None
+    values = None # list of values, or None for a range
+    low = None
+    high = None
+
+    def __init__(self, path, values=None, low=None, high=None):
+        self.path = path
+        self.values = values
+        self.low = low
+        self.high = high
+
+    def grid(self):
+        if self.values is None:
+            raise ValueError('Sweep error: ' + self.path + ' needs a list or lo:hi:n for a grid')
+        return self.values
+
+    def sample(self, rng):
+        if self.values is None:
+            return float(rng.uniform(self.low, self.high))
+        return self.values[rng.randint(len(self.values))]
+
+# 'path=1,2,3', 'path=lo:hi:n' or 'path=lo:hi'
+def parse_param(text):
+    path, sep, values = text.partition('=')
+    if not sep or not values:
+        raise ValueError('Sweep error: expected path=values, got ' + text)
+    if ':' in values:
+        bounds = [float(v) for v in values.split(':')]
+        if len(bounds) == 3:
+            return Param(path, [float(v) for v in np.linspace(bounds[0], bounds[1], int(bounds[2]))])
+        return Param(path, low=bounds[0], high=bounds[1])
+    return Param(path, [float(v) for v in values.split(',')])
+
+# One dict of {path: value} per variant
+def make_variants(params, random=None, seed=None):
+    if random is None:
+        paths = [param.path for param in params]
+        return [dict(zip(paths, combo)) for combo in itertools.product(*[param.grid() for param in params])]
+    rng = np.random.RandomState(seed)
+    return [{param.path: param.sample(rng) for param in params} for _ in range(random)]
+
+# Copies of objects/joints with the variant's values, and the control
+# constants it sets
+def apply_variant(objects, joints, variant):
+    objects = copy.deepcopy(objects)
+    joints = copy.deepcopy(joints)
+    constants = {}
+    for path, value in variant.items():
+        parts = path.split('.')
+        if parts[0] == 'controls' and len(parts) == 2:
+            constants[parts[1]] = value
+            continue
+        if parts[0] not in ('objects', 'joints') or len(parts) not in (4, 5):
+            raise ValueError('Sweep error: cannot interpret parameter ' + path)
+
+        matched = False
+        for entry in objects if parts[0] == 'objects' else joints:
+            if parts[1] not in ('*', entry['name']):
+                continue
+            section = entry.get(parts[2])
+            if section is None or parts[3] not in section:
+                continue
+            if len(parts) == 5:
+                old = section[parts[3]]
+                new = list(old)
+                new[int(parts[4])] = value
+                value_to_set = tuple(new) if isinstance(old, tuple) else new
+            else:
+                value_to_set = value
+            entry[parts[2]] = dict(section, **{parts[3]: value_to_set})
+            matched = True
+        if not matched:
+            raise ValueError('Sweep error: parameter ' + path + ' does not match the morphology')
+    return objects, joints, constants
+
+# Control functions read the constants as module globals, so they are set on
+# the module (and put back before the next variant in this worker)
+def set_control_constants(module, constants):
+    defaults = control_defaults.setdefault(module.__name__, {})
+    for name, value in defaults.items():
+        setattr(module, name, value)
+    for name, value in constants.items():
+        if not hasattr(module, name):
+            raise ValueError('Sweep error: ' + module.__name__ + ' has no control constant ' + name)
+        defaults.setdefault(name, getattr(module, name))
+        setattr(module, name, value)
+
+# =====
+# Policies
+# =====
+
+# Cycles through a fixed list of actions
+class ScriptPolicy():
+
+    actions = None
+    tick = 0
+
+    def __init__(self, actions):
+        self.actions = list(actions)
+        self.tick = 0
+
+    def act(self, observation):
+        action = self.actions[self.tick % len(self.actions)]
+        self.tick += 1
+        return action
+
+# Uniform random actions from a fixed seed, so every variant sees the same
+# action sequence
+class RandomPolicy():
+
+    rng = None
+    num_actions = 8
+
+    def __init__(self, seed=None, num_actions=8):
+        self.rng = np.random.RandomState(seed)
+        self.num_actions = num_actions
+
+    def act(self, observation):
+        return self.rng.randint(self.num_actions)
+
+def make_policy(policy):
+    kind, _, arg = policy.partition(':')
+    if kind == 'script':
+        return ScriptPolicy(int(a) for a in arg.split(','))
+    elif kind == 'random':
+        return RandomPolicy(int(arg) if arg else None)
+    elif kind == 'linear':
+        import rollout
+        with np.load(arg) as params:
+            return rollout.LinearPolicy(params)
+    raise ValueError('Sweep error: unknown policy ' + policy)
+
+# =====
+# Evaluation
+# =====
+
+# Runs in a pool worker: build the variant and play its episodes
+def evaluate(task):
+    import uniped
+
+    index, morphology, variant, policy, episodes, max_steps = task
+    objects, joints, module = morphology_lib.resolve(morphology)
+    objects, joints, constants = apply_variant(objects, joints, variant)
+    set_control_constants(module, constants)
+
+    env = uniped.Uniped(
+        objects, joints, module.key_events, module.control_events, 'body',
+        render_window=False
+    )
+    policy = make_policy(policy)
+
+    distances, lengths, terminations = [], [], []
+    steps = 0
+    start = time.perf_counter()
+    for _ in range(episodes):
+        observation = env._reset()
+        done = False
+        length = 0
+        info = {}
+        while not done and length < max_steps:
+            observation, reward, done, info = env._step(policy.act(observation))
+            length += 1
+        distances.append(env._get_total_distance(env._get_state()))
+        lengths.append(length)
+        terminations.append(info.get('termination', 'max_steps'))
+        steps += length
+    elapsed = time.perf_counter() - start
+    env._close()
+
+    return dict(
+        variant,
+        variant=index,
+        distance=float(np.mean(distances)),
+        episode_length=float(np.mean(lengths)),
+        steps_per_sec=steps / elapsed if elapsed > 0 else 0.0,
+        termination=max(set(terminations), key=terminations.count)
+    )
+
+def run_sweep(morphology, variants, policy='random:0', episodes=1, max_steps=1200, workers=None):
+    tasks = [
+        (index, morphology, variant, policy, episodes, max_steps)
+        for index, variant in enumerate(variants)
+    ]
+    with multiprocessing.Pool(workers) as pool:
+        results = list(pool.imap_unordered(evaluate, tasks))
+    return sorted(results, key=lambda result: result['variant'])
+
+# =====
+# Results
+# =====
+
+RESULT_COLUMNS = ['distance', 'episode_length', 'steps_per_sec', 'termination']
+
+def write_results(results, paths, out):
+    writer = csv.DictWriter(out, ['variant'] + paths + RESULT_COLUMNS)
+    writer.writeheader()
+    writer.writerows(results)
+
+def print_results(results, paths, top=None):
+    ranked = sorted(results, key=lambda result: result['distance'], reverse=True)[:top]
+    columns = ['variant'] + paths + RESULT_COLUMNS
+    rows = [[
+        '%.4g' % result[column] if isinstance(result[column], float) else str(result[column])
+        for column in columns
+    ] for result in ranked]
+    widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep morphology parameters and control constants')
+    parser.add_argument('morphology', help='morphology module or file, e.g. kangaroo or pogo.json')
+    parser.add_argument('--param', action='append', default=[], required=True,
+                        help='path=v1,v2,... or path=lo:hi:n (grid) or path=lo:hi (--random)')
+    parser.add_argument('--random', type=int, default=None, metavar='N',
+                        help='evaluate N random variants instead of the full grid')
+    parser.add_argument('--policy', default='random:0',
+                        help="'random:SEED', 'script:0,0,3,...' or 'linear:params.npz'")
+    parser.add_argument('--episodes', type=int, default=1)
+    parser.add_argument('--max-steps', type=int, default=1200)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None, help='seed for --random')
+    parser.add_argument('--out', help='write the results table to this .csv file')
+    parser.add_argument('--top', type=int, default=20, help='rows to print, best distance first')
+    args = parser.parse_args()
+
+    params = [parse_param(text) for text in args.param]
+    paths = [param.path for param in params]
+    variants = make_variants(params, args.random, args.seed)
+
+    # Fail on bad paths here rather than in every worker
+    objects, joints, module = morphology_lib.resolve(args.morphology)
+    apply_variant(objects, joints, variants[0])
+    make_policy(args.policy)
+
+    start = time.perf_counter()
+    results = run_sweep(args.morphology, variants, args.policy, args.episodes, args.max_steps, args.workers)
+    print('%d variants in %.1fs' % (len(results), time.perf_counter() - start), file=sys.stderr)
+
+    if args.out:
+        with open(args.out, 'w', newline='') as f:
+            write_results(results, paths, f)
+    print_results(results, paths, args.top)
@@ -0,0 +1,171 @@
+'''
+
+This generates procedural terrain (slopes, stairs, bumps) as fixed-width
+chunks that are streamed in ahead of the robot and destroyed behind it, so
+the broadphase only ever holds a bounded number of ground fixtures. Far from
+the start the world origin is moved along with the robot (see
+Engine.shift_origin) to keep Box2D coordinates small.
+
+'''
+
+import copy
+import functools
+import math
+
+import Box2D.b2 as b2
+import numpy as np
+
+import engine
+
+# Chunk kinds
+FLAT, SLOPE, STAIRS, BUMPS = 'flat', 'slope', 'stairs', 'bumps'
+KINDS = (SLOPE, STAIRS, BUMPS)
+
+def chunk_rng(seed, index, stream):
+    # RandomState seeds must be unsigned 32 bit
+    return np.random.RandomState([seed & 0xFFFFFFFF, index & 0xFFFFFFFF, stream])
+
+# Surface segments (x0, y0, x1, y1) of chunk index, x relative to the chunk
+# start. Depends only on its arguments, so layouts are cached by seed.
+@functools.lru_cache(maxsize=4096)
+def chunk_layout(seed, index, chunk_width, segment_width, base_height, amplitude,
+                 max_step, bump_height, flat_start):
+    def is_flat(k):
+        return k * chunk_width < flat_start and (k + 1) * chunk_width > -flat_start
+
+    # Chunks meet at knot heights drawn per boundary, so neighbours line up
+    # without having to generate each other
+    def knot(k):
+        if is_flat(k - 1) or is_flat(k):
+            return base_height
+        return base_height + chunk_rng(seed, k, 0).uniform(-amplitude, amplitude)
+
+    start, end = knot(index), knot(index + 1)
+    rng = chunk_rng(seed, index, 1)
+    kind = FLAT if is_flat(index) else KINDS[rng.randint(len(KINDS))]
+    num_segments = max(1, int(round(chunk_width / segment_width)))
+    xs = np.linspace(0, chunk_width, num_segments + 1)
+
+    segments = []
+    if kind == STAIRS:
+        # Flat treads with risers no higher than max_step
+        num_risers = min(num_segments - 1, int(math.ceil(abs(end - start) / max_step)))
+        for i in range(num_segments):
+            tread = i * (num_risers + 1) // num_segments
+            height = start + (end - start) * tread / num_risers if num_risers else start
+            segments.append((xs[i], height, xs[i + 1], height))
+    else:
+        ts = xs / chunk_width
+        ys = start + (end - start) * ts
+        if kind == BUMPS:
+            num_bumps = 1 + rng.randint(3)
+            ys = ys + rng.uniform(0.3, 1.0) * bump_height * np.sin(math.pi * num_bumps * ts) ** 2
+        for i in range(num_segments):
+            segments.append((xs[i], ys[i], xs[i + 1], ys[i + 1]))
+    return tuple((float(x0), float(y0), float(x1), float(y1)) for x0, y0, x1, y1 in segments)
+
+class Terrain():
+
+    # Layout
+    seed = 0
+    chunk_width = 16.0 # meters per chunk
+    segment_width = 1.0 # meters per ground fixture
+    base_height = 5.0 # surface height at the start (same as the flat ground)
+    amplitude = 1.5 # chunk boundary heights are base_height +- amplitude
+    max_step = 0.3 # highest riser of a staircase
+    bump_height = 0.4
+    flat_start = 20.0 # flat ground within this distance of the start
+    friction = 0.5
+
+    # Streaming
+    ahead = 3 # chunks kept ahead of the robot
+    behind = 2 # chunks kept behind it
+    rebase_distance = 512.0 # move the origin once the robot is this far from it
+    length = None # distance that ends the episode (None = endless)
+
+    # Live chunks: index -> body
+    chunks = None
+
+    def __init__(self, seed=0, chunk_width=16.0, segment_width=1.0, amplitude=1.5,
+                 max_step=0.3, bump_height=0.4, flat_start=20.0, friction=0.5,
+                 ahead=3, behind=2, rebase_distance=512.0, length=None):
+        self.seed = seed
+        self.chunk_width = chunk_width
+        self.segment_width = segment_width
+        self.amplitude = amplitude
+        self.max_step = max_step
+        self.bump_height = bump_height
+        self.flat_start = flat_start
+        self.friction = friction
+        self.ahead = ahead
+        self.behind = behind
+        self.rebase_distance = rebase_distance
+        self.length = length
+        self.chunks = {}
+
+    def layout(self, index):
+        return chunk_layout(
+            self.seed, index, self.chunk_width, self.segment_width, self.base_height,
+            self.amplitude, self.max_step, self.bump_height, self.flat_start
+        )
+
+    # Keep the chunks around [x_min, x_max] (world x of the tracked robots,
+    # in Box2D coordinates) and drop the rest. Moves the origin first if the
+    # robots got too far from it.
+    def stream(self, eng, x_min, x_max):
+        if abs(x_min) > self.rebase_distance:
+            eng.shift_origin(x_min)
+            x_max -= x_min
+            x_min = 0.0
+
+        first = int(math.floor((x_min + eng.origin_x) / self.chunk_width)) - self.behind
+        last = int(math.floor((x_max + eng.origin_x) / self.chunk_width)) + self.ahead
+
+        for index in [index for index in self.chunks if index < first or index > last]:
+            self.destroy_chunk(eng, index)
+        for index in range(first, last + 1):
+            if index not in self.chunks:
+                self.create_chunk(eng, index)
+
+    def create_chunk(self, eng, index):
+        body = eng.world.CreateStaticBody(position=(index * self.chunk_width - eng.origin_x, 0))
+        collision_filter = b2.filter(categoryBits=engine.GROUND_CATEGORY, maskBits=0xFFFF, groupIndex=0)
+        for x0, y0, x1, y1 in self.layout(index):
+            fixture = body.CreatePolygonFixture(
+                vertices=[(x0, 0), (x1, 0), (x1, y1), (x0, y0)],
+                friction=self.friction
+            )
+            fixture.filterData = collision_filter
+        body.color = (80, 80, 80, 255)
+        # Named like the flat ground so contacts and rendering treat it alike
+        body.userData = {
+            'name': 'ground'
+        }
+        eng.bodies['ground/%d' % index] = body
+        self.chunks[index] = body
+        eng.ground_version += 1
+
+    def destroy_chunk(self, eng, index):
+        eng.world.DestroyBody(self.chunks.pop(index))
+        eng.bodies['ground/%d' % index] = None
+        eng.ground_version += 1
+
+    def set_friction(self, friction):
+        self.friction = friction
+        for body in self.chunks.values():
+            for fixture in body.fixtures:
+                fixture.friction = friction
+
+    def num_fixtures(self):
+        return sum(len(body.fixtures) for body in self.chunks.values())
+
+# Terrain for one engine from a Terrain (copied, since it tracks the chunks
+# of its world), a dict of Terrain arguments or None
+def make(terrain):
+    if terrain is None:
+        return None
+    if isinstance(terrain, Terrain):
+        terrain = copy.copy(terrain)
+        terrain.chunks = {}
+        return terrain
+    return Terrain(**terrain)
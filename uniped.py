@@ -5,21 +5,134 @@ This implements the unipedal kangaroo and pogo using the OpenAI Gym interface
 '''
 
 # external libraries
+import itertools
+import time
 import Box2D.b2 as b2
 import gym
 import gym.utils
+from gym.utils import seeding
 
 # internal libraries
 import engine
 import contact
+import morphology as morphology_lib
+import randomization as randomization_lib
+import terrain as terrain_lib
+import sensors
+import observations
+import rewards
+import replay as replay_lib
+import diagnostics
+import hud as hud_lib
+import start_states as start_states_lib
 
 # Time (in seconds) to be considered finished with the simulation
 MAX_TIME = 60.0 * 2.0
 
-# Helper functions
-def draw_text(eng, text, location):
-    text_surface = eng.font.render(text, True, (80, 80, 80))
-    eng.screen.blit(text_surface, location)
+# Episode end reasons that are cut-offs rather than failures (or successes)
+TRUNCATIONS = ('time_limit', 'stalled', 'asleep')
+
+# Bodies the done checks read
+DONE_BODIES = ('body', 'head')
+
+# Human play (see play): physics ticks a slow frame may catch up on before
+# the game slows down instead, and the key that pauses
+MAX_CATCH_UP = 5
+PAUSE_KEY = 'K_SPACE'
+
+# Colors for the extra robots of a MultiUniped race
+ROBOT_COLORS = [
+    (200, 60, 60, 100),
+    (60, 160, 60, 100),
+    (200, 160, 40, 100),
+    (140, 60, 180, 100),
+    (40, 160, 180, 100)
+]
+
+# Build a Uniped from the name of a morphology module ('kangaroo', 'pogo') or
+# a morphology file ('kangaroo.json', see morphology.load)
+def make(morphology, obj_to_follow='body', **kwargs):
+    objects, joints, module = morphology_lib.resolve(morphology)
+    return Uniped(
+        objects, joints, module.key_events, module.control_events,
+        obj_to_follow, **kwargs
+    )
+
+# Play env with the keyboard and mouse. Physics advances in fixed
+# TIME_STEP ticks at real-time speed whatever the frame rate: each frame runs
+# the ticks that wall-clock time has accumulated (at most max_catch_up), then
+# renders once, fps times a second, interpolated between the last two ticks by
+# the time left over. While paused or finished (until reset) it sleeps on the
+# event queue. on_done(info) is called when an episode ends.
+def play(env, max_catch_up=MAX_CATCH_UP, fps=engine.DISPLAY_FPS, on_done=None):
+    eng = env.eng
+    eng.interpolate = True
+    pygame = engine.load_pygame()
+    status = {'paused': False}
+
+    def toggle_pause(eng, world, bodies, body_names, joints, joint_names, custom_dat):
+        status['paused'] = not status['paused']
+
+    # The env's bindings plus pause, in place only while playing (_step
+    # dispatches events with env.key_events), so playing again starts from
+    # the env's own list
+    own_key_events = env.key_events
+    env.key_events = own_key_events + [{
+        'key': PAUSE_KEY,
+        'type': 'KEYDOWN',
+        'fn': toggle_pause,
+        'body_names': [],
+        'joint_names': []
+    }]
+    try:
+        env._render()
+        eng.allow_events(env.key_events, ('VIDEOEXPOSE',))
+
+        finished = False
+        epoch = env.curr_epoch
+        lag = 0.0
+        previous = time.perf_counter()
+        while True:
+            if status['paused'] or finished:
+                eng.dispatch_events([pygame.event.wait()], env.key_events, env)
+                if env.curr_epoch != epoch:
+                    # Reset from the keyboard
+                    finished = False
+                    epoch = env.curr_epoch
+                eng.render_alpha = 1.0
+                env._render()
+                lag = 0.0
+                previous = time.perf_counter()
+                continue
+
+            now = time.perf_counter()
+            lag += now - previous
+            previous = now
+            ticks = int(lag / engine.TIME_STEP)
+            if ticks > max_catch_up:
+                # Too far behind: drop the rest rather than spiral
+                ticks = max_catch_up
+                lag = 0.0
+            else:
+                lag -= ticks * engine.TIME_STEP
+
+            for _ in range(ticks):
+                observation, reward, done, info = env._step(None)
+                if env.curr_epoch != epoch:
+                    epoch = env.curr_epoch
+                    break
+                if done:
+                    if on_done is not None:
+                        on_done(info)
+                    finished = True
+                    break
+                if status['paused']:
+                    break
+            eng.render_alpha = min(1.0, lag / engine.TIME_STEP)
+            env._render()
+            eng.clock.tick(fps)
+    finally:
+        env.key_events = own_key_events
 
 # Uniped class
 class Uniped(gym.Env):
@@ -32,14 +145,60 @@ class Uniped(gym.Env):
     key_events = []
     control_events = []
 
+    # Compiled morphology (see morphology.compile_plan)
+    plan = None
+
+    # Placement when several robots share one world (see MultiUniped)
+    shared_eng = False
+    prefix = '' # prepended to body/joint names
+    offset = (0, 0) # added to spawn positions
+    group = 0 # robot number for collision filtering, 0 = spec filtering only
+
     # State
     prev_state = None
     curr_epoch = 0
     prev_dist = 0
     prev_foot = False
 
+    # Early termination (None/False = disabled)
+    stall_window = None # ticks allowed to make stall_distance of forward progress
+    stall_distance = 0.1
+    stop_when_asleep = False # end once every robot body is asleep
+    max_tilt = None # radians of body tilt considered unrecoverable
+    termination = None # reason an early termination detector fired
+    stall_x = 0
+    stall_tick = 0
+
+    # Library of settled poses to start episodes from (None = drop from spawn)
+    start_states = None
+    np_random = None
+
+    # Domain randomization applied on every reset (None = spec physics)
+    randomization = None
+    randomization_sample = None
+
+    # Height-scan sensor whose readings are appended to observations (None = off)
+    height_scan = None
+
+    # Compiled observation spec (see observations.py)
+    observation_plan = None
+    observation_names = None
+
+    # Reward shaping (see rewards.py)
+    reward = None
+
+    # Ring buffer the env's transitions go to (None = off, see replay.py)
+    replay = None
+    last_observation = None
+
+    # Diagnostics: per-step info (off = only the episode summary on done)
+    step_info = False
+    episode_stats = None
+
     # Render params
     obj_to_follow = None
+    hud = None
+    hud_layer = None # custom render list handed to Engine.render
 
     # RL params
     actions = []
@@ -63,108 +222,251 @@ class Uniped(gym.Env):
         self,
         objects=[], joints=[], key_events=[], control_events=[],
         obj_to_follow='',
-        render_window=True, render_video=False, video_file=None
+        render_window=True, render_video=False, video_file=None,
+        start_states=None,
+        stall_window=None, stall_distance=0.1, stop_when_asleep=False, max_tilt=None,
+        randomization=None, terrain=None, height_scan=None, observation=None,
+        reward=None, step_info=False, show_perf=False, replay=None,
+        eng=None, prefix='', offset=(0, 0), group=0
     ):
-        # Create members
-        self.eng = engine.Engine(
-            contact.Hit_body_ground(),
-            render_window, render_video, video_file
-        )
+        # Create members (robots sharing a world are handed its engine)
+        self.shared_eng = eng is not None
+        if eng is None:
+            eng = engine.Engine(
+                contact.Hit_body_ground(),
+                render_window, render_video, video_file,
+                terrain=terrain_lib.make(terrain)
+            )
+        self.eng = eng
         self.objects = objects
         self.joints = joints
-        self.key_events = key_events
-        self.control_events = control_events
         self.obj_to_follow = obj_to_follow
-
-        # Create action space
-        for i in range(3):
-            for j in range(3):
-                for k in range(3):
-                    for l in range(3):
-                        for m in range(3):
-                            self.actions.append([i, 3 + j, 6 + k, 9 + l, 12 + m])
-
-        # Initialize engine and objects in engine
-        self._reset()
+        self.body_names = [obj['name'] for obj in objects]
+        self.joint_names = [joint['name'] for joint in joints]
+        self.plan = morphology_lib.compile_plan(objects, joints)
+
+        # Place this robot's copy of the morphology and its controls
+        self.prefix = prefix
+        self.offset = tuple(offset)
+        self.group = group
+        self.key_events = self._place_events(key_events)
+        self.control_events = self._place_events(control_events)
+
+        # Early termination detectors
+        self.stall_window = stall_window
+        self.stall_distance = stall_distance
+        self.stop_when_asleep = stop_when_asleep
+        self.max_tilt = max_tilt
+
+        # Start state library (path or StartStateLibrary)
+        if isinstance(start_states, str):
+            start_states = start_states_lib.load(start_states)
+        if start_states is not None:
+            start_states.validate(self.objects, self.joints)
+        self.start_states = start_states
+
+        # Domain randomization (Randomization or dict of ranges)
+        self.randomization = randomization_lib.make(randomization)
+
+        # Terrain sensor (HeightScan or dict of HeightScan arguments)
+        self.height_scan = sensors.make(height_scan)
+
+        # What observations contain (dict, see observations.DEFAULT_SPEC),
+        # followed by the height scan
+        scan_size = len(self.height_scan) if self.height_scan is not None else 0
+        self.observation_plan = observations.ObservationPlan(observation, objects, joints, scan_size)
+        self.observation_names = self.observation_plan.names + [
+            'height_scan.%d' % i for i in range(scan_size)
+        ]
+
+        # Reward shaping (Reward, or weighted terms as [(name, weight)] or
+        # {name: weight}, see rewards.TERMS)
+        self.reward = rewards.make(reward)
+
+        # Transitions written into a ring buffer as the env steps
+        # (ReplayBuffer, capacity or dict of ReplayBuffer arguments)
+        self.replay = replay_lib.make(replay, len(self.observation_names))
+
+        # Gait counters, summarized in the info of the last step (every step
+        # also gets foot contact info with step_info)
+        self.step_info = step_info
+        self.episode_stats = diagnostics.EpisodeStats()
+
+        # Heads-up display (built once, drawn on every render)
+        self.hud = hud_lib.Hud(show_perf)
+        self.hud_layer = [{'fn': self._draw_hud, 'args': {}}]
+
+        # Create action space (control events come in ccw/none/cw triples)
+        self.actions = []
+        for combo in itertools.product(range(3), repeat=len(control_events) // 3):
+            self.actions.append([3 * group + c for group, c in enumerate(combo)])
 
         # Run initialization functions
         self._seed()
 
+        # Initialize engine and objects in engine (a shared world is built by its owner)
+        if not self.shared_eng:
+            self._reset()
+
     # =====
     # OpenAI Gym interface
     # =====
 
     def _seed(self, seed=None):
-        pass
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
 
-    def _reset(self):
+    # sample: randomization to apply (see VectorUniped, which draws them for
+    # all its envs at once); drawn from np_random if not given
+    def _reset(self, sample=None):
         # Clear all objects from the engine
         self.eng.reset()
 
         # Re-add all the objects to the engine
-        for obj in self.objects:
-            self.eng.add_object(**obj)
-
-        for joint in self.joints:
-            self.eng.add_joint(**joint)
+        self._build(sample)
 
         # Increment current epoch
         self.curr_epoch += 1
 
         # Get state
-        return self._get_vector_state()
+        observation = self._get_vector_state()
+        if self.replay is not None:
+            self.replay.end_stream(0)
+            self.last_observation = observation
+        return observation
+
+    def _build(self, sample=None):
+        self.plan.build(self.eng, self.prefix, self.offset, self.group)
+        self.observation_plan.bind(self.eng, self.prefix, self.offset[0])
+
+        # Randomize the new bodies/joints in place (the world-wide ground and
+        # gravity only if this robot owns the world)
+        if self.randomization is not None:
+            if sample is None:
+                sample = self.sample_randomization()
+            self.randomization.apply(self.eng, self.plan, sample, self.prefix, not self.shared_eng)
+            self.randomization_sample = sample
+
+        # Skip the initial drop by starting from a settled pose
+        if self.start_states is not None:
+            self.start_states.restore(
+                self.eng, self.start_states.sample(self.np_random), self.prefix, self.offset
+            )
+
+        # Stream in the terrain around the spawn point
+        if self.eng.terrain is not None and not self.shared_eng:
+            self._stream_terrain()
+
+        # Reset per-episode tracking
+        state = self._get_state()
+        self.prev_dist = self._get_total_distance(state)
+        self.prev_foot = self._foot_hit_ground(state)
+        self.termination = None
+        self.stall_x = self.prev_dist
+        self.stall_tick = 0
+        self.episode_stats.reset(self)
 
     def _render(self, mode='human', close=False):
         if not close:
-            state = self._get_state()
-            body_pos = state['bodies']['body']['position']
-            text = [
-                {
-                    'fn': draw_text,
-                    'args': {
-                        'text': 'x-distance: ' + str(body_pos[0]),
-                        'location': (8, 0)
-                    }
-                },
-                {
-                    'fn': draw_text,
-                    'args': {
-                        'text': 'current epoch: ' + str(self.curr_epoch),
-                        'location': (8, 16)
-                    }
-                }
-            ]
-            self.eng.render(self.obj_to_follow, True, False, text)
-
-    def _step(self, action):
+            self.eng.render(self.obj_to_follow, True, False, self.hud_layer)
+
+    def _draw_hud(self, eng):
+        # Where the body is drawn (interpolated), not where physics has it
+        x = eng.get_render_position(self.prefix + 'body')[0] + eng.origin_x
+        self.hud.draw(eng, [
+            'x-distance: ' + self.hud.number(x),
+            'current epoch: %d' % self.curr_epoch
+        ])
+
+    # reward=False leaves the reward to the caller (see VectorUniped, which
+    # evaluates it for all its envs at once) and returns None for it
+    def _step(self, action, reward=True):
         # Apply action
+        self.eng.handle_controls(self.key_events, self._get_controls(action), self)
+        self.eng.step()
+        if self.eng.terrain is not None and not self.shared_eng:
+            self._stream_terrain()
+        result = self._observe(reward)
+        if self.replay is not None and reward:
+            observation, step_reward, done, info = result
+            self.replay.add(self.last_observation, action, step_reward, observation, done)
+            self.last_observation = observation
+        return result
+
+    def _stream_terrain(self):
+        x = self.eng.bodies[self.prefix + 'body'].position[0]
+        self.eng.terrain.stream(self.eng, x, x)
+
+    def _get_controls(self, action):
         if action in range(0, 8):
             control_idx = self.actions[action]
-            controls = [self.control_events[idx] for idx in control_idx]
+            return [self.control_events[idx] for idx in control_idx]
         else:
-            controls = []
-        self.eng.handle_controls(self.key_events, controls, self)
-        self.eng.step()
+            return []
 
-        state = self._get_state()
+    # Everything _step returns, once the world has been stepped
+    def _observe(self, reward=True):
+        self._check_early_termination()
+
+        # Only the bodies the done checks need, unless per-step info is on
+        if self.step_info:
+            state = self._get_state()
+        else:
+            state = self.eng.get_state(DONE_BODIES, (), self.prefix)
         # Return:
         # observation (object),
         observation = self._get_vector_state()
         # reward (float),
-        reward = self._get_reward(state)
+        reward = self._get_reward(state) if reward else None
         # done (bool),
         done = self._is_done(state)
         # custom info (dict)
-        custom = {
-            "foot_hit_ground": self._foot_hit_ground(state),
-            "foot_edge": self._get_and_set_edge_foot(state)
-        }
+        stats = self.episode_stats
+        stats.update(self)
+        if reward is not None:
+            stats.add_reward(reward)
+        if self.step_info:
+            custom = {
+                "foot_hit_ground": self._foot_hit_ground(state),
+                "foot_edge": self._get_and_set_edge_foot(state),
+                "foot_contact": stats.foot_down
+            }
+        else:
+            custom = {}
+        if done:
+            reason = self._get_termination(state)
+            custom["termination"] = reason
+            custom["truncated"] = reason in TRUNCATIONS
+            custom["episode"] = stats.summary(self)
         return observation, reward, done, custom
 
     def _close(self):
-        if self.eng is not None:
+        if self.eng is not None and not self.shared_eng:
             self.eng.quit()
 
+    def sample_randomization(self):
+        batch = self.randomization.sample(self.np_random, len(self.plan.bodies), len(self.plan.joints))
+        return self.randomization.unbatch(batch, 0)
+
+    # =====
+    # Placement in a shared world
+    # =====
+
+    # Robots share the compiled morphology; the plan applies this robot's
+    # prefix, offset and collision group as it builds. The controls are
+    # placed here.
+    def _place_events(self, events):
+        if not self.prefix:
+            return events
+        return [
+            dict(
+                event,
+                body_names=[self.prefix + name for name in event['body_names']],
+                joint_names=[self.prefix + name for name in event['joint_names']]
+            )
+            for event in events
+        ]
+
     # =====
     # Helpers and custom functions
     # =====
@@ -172,33 +474,13 @@ class Uniped(gym.Env):
     # ===== State checks =====
 
     def _get_state(self):
-        return self.eng.get_state()
+        return self.eng.get_state(self.body_names, self.joint_names, self.prefix)
 
     def _get_vector_state(self):
-        state = self._get_state()
-        vec_state = []
-
-        offset_x, offset_y = state['bodies']['body']['position']
-        offset_y = 0
-
-        for key in sorted(state['bodies'].keys()):
-            if key != 'ground' and key != 'mouse' and key != 'foot':
-                position = state['bodies'][key]['position']
-                relative_x = position[0] - offset_x
-                relative_y = position[1] - offset_y
-
-                vec_state.append(relative_x)
-                vec_state.append(relative_y)
-                vec_state.append(state['bodies'][key]['angle'])
-
-                vec_state += state['bodies'][key]['lin_vel']
-                vec_state.append(state['bodies'][key]['ang_vel'])
-
-        for key in sorted(state['joints'].keys()):
-            if key != 'joint_mouse' and key != 'joint_bottom':
-                vec_state.append(state['joints'][key]['force'])
-
-        return vec_state
+        observation = self.observation_plan.gather()
+        if self.height_scan is not None:
+            observation[self.observation_plan.size:] = self.height_scan.scan(self.eng, self.prefix)
+        return observation.copy()
 
     def _get_distance(self, state, obj_name, get_x=True, value='position'):
         if obj_name in state['bodies']:
@@ -209,14 +491,9 @@ class Uniped(gym.Env):
         else:
             return 0
 
+    # Distance from the spawn point, counting any origin shifts (see terrain)
     def _get_total_distance(self, state):
-        return self._get_distance(state, 'body')
-
-    def _get_and_reset_delta_distance(self, state):
-        curr_dist = self._get_total_distance(state)
-        delta = curr_dist - self.prev_dist
-        self.prev_dist = curr_dist
-        return delta
+        return self._get_distance(state, 'body') + self.eng.origin_x - self.offset[0]
 
     def _check_hit_ground(self, state, obj_name):
         if obj_name in state['bodies']:
@@ -242,32 +519,61 @@ class Uniped(gym.Env):
     # ===== Rewards =====
 
     def _get_reward(self, state):
-        if self._done_hit_ground(state):
-            return -1.0
-        else:
-            y_vel = self._get_distance(state, 'body', False, 'lin_vel')
-            head_y = self._get_distance(state, 'head', False)
-            body_y = self._get_distance(state, 'body', False)
-            foot_y = self._get_distance(state, 'foot', False)
-            return (
-                #0.01 * self._get_total_distance(state) + 
-                0.8 * self._get_and_reset_delta_distance(state) + 
-                0#0.005 * int(y_vel > 0.0) * y_vel +
-                #-1 * int(y_vel < 0.0) +
-                #2 * int(head_y > body_y) + 
-                #5 * int(foot_y < body_y) +
-                #-10 * int(foot_y > body_y)
-            )
+        return self.reward.evaluate(self)
 
     # ===== Finished conditions =====
 
     def _is_done(self, state):
         return (
             self._done_hit_ground(state) or
+            self.termination is not None or
             self._done_reached_time(state) or
             self._done_reached_distance(state)
         )
 
+    # Why the episode ended: failures ('hit_ground', 'tilted'), success
+    # ('reached_distance') or truncations (see TRUNCATIONS)
+    def _get_termination(self, state):
+        if self._done_hit_ground(state):
+            return 'hit_ground'
+        elif self.termination is not None:
+            return self.termination
+        elif self._done_reached_distance(state):
+            return 'reached_distance'
+        elif self._done_reached_time(state):
+            return 'time_limit'
+        else:
+            return None
+
+    # Runs every tick, so each detector is O(1) in the common case
+    def _check_early_termination(self):
+        if self.termination is not None:
+            return
+        body = self.eng.bodies[self.prefix + 'body']
+
+        if self.max_tilt is not None:
+            angle = (body.angle + b2.pi) % (2 * b2.pi) - b2.pi
+            if abs(angle) > self.max_tilt:
+                self.termination = 'tilted'
+                return
+
+        if self.stall_window is not None:
+            if self.eng.num_ticks - self.stall_tick >= self.stall_window:
+                x = body.position[0] + self.eng.origin_x - self.offset[0]
+                if x - self.stall_x < self.stall_distance:
+                    self.termination = 'stalled'
+                    return
+                self.stall_x = x
+                self.stall_tick = self.eng.num_ticks
+
+        if self.stop_when_asleep:
+            # Stops at the first awake body, which is almost always the first
+            bodies = self.eng.bodies
+            for name in self.body_names:
+                if bodies[self.prefix + name].awake:
+                    return
+            self.termination = 'asleep'
+
     def _done_hit_ground(self, state):
         return self._done_body_hit_ground(state) or self._done_head_hit_ground(state)
 
@@ -284,7 +590,132 @@ class Uniped(gym.Env):
             return False
 
     def _done_reached_distance(self, state):
-        if self._get_total_distance(state) >= engine.GROUND_WIDTH:
+        terrain = self.eng.terrain
+        length = engine.GROUND_WIDTH if terrain is None else terrain.length
+        if length is not None and self._get_total_distance(state) >= length:
             return True
         else:
             return False
+
+# =====
+# Several robots in one world
+# =====
+
+# Copies of a morphology racing side by side in a single Box2D world. Each
+# robot is a Uniped sharing this engine, in its own collision group, so the
+# robots never touch each other but share the ground, the broadphase and a
+# single world.Step. The first robot gets the keyboard/mouse controls.
+class MultiUniped(gym.Env):
+    # The shared physics engine
+    eng = None
+
+    # The robots (Uniped instances)
+    robots = []
+
+    # State
+    curr_epoch = 0
+    np_random = None
+
+    # Render params
+    obj_to_follow = None
+    hud = None
+    hud_layer = None
+    distances = None # of every robot, as of the last render
+
+    metadata = Uniped.metadata
+
+    def __init__(
+        self,
+        objects=[], joints=[], key_events=[], control_events=[],
+        obj_to_follow='',
+        render_window=True, render_video=False, video_file=None,
+        num_robots=2, robot_spacing=0.0, terrain=None, show_perf=False,
+        **kwargs
+    ):
+        self.eng = engine.Engine(
+            contact.Hit_body_ground(),
+            render_window, render_video, video_file,
+            terrain=terrain_lib.make(terrain)
+        )
+        self.obj_to_follow = obj_to_follow
+        self.hud = hud_lib.Hud(show_perf)
+        self.hud_layer = [{'fn': self._draw_hud, 'args': {}}]
+
+        self.robots = []
+        for k in range(num_robots):
+            robot_objects = objects
+            if k > 0:
+                color = ROBOT_COLORS[(k - 1) % len(ROBOT_COLORS)]
+                robot_objects = [dict(obj, color=obj.get('color', color)) for obj in objects]
+            self.robots.append(Uniped(
+                robot_objects, joints,
+                key_events if k == 0 else [], control_events,
+                obj_to_follow,
+                eng=self.eng,
+                prefix='' if k == 0 else 'robot%d/' % k,
+                offset=(k * robot_spacing, 0),
+                group=k + 1,
+                **kwargs
+            ))
+
+        self._seed()
+        self._reset()
+
+    # =====
+    # OpenAI Gym interface
+    # =====
+
+    def _seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        for robot in self.robots:
+            robot._seed(int(self.np_random.randint(2 ** 31)))
+        return [seed]
+
+    def _reset(self):
+        self.eng.reset()
+        for robot in self.robots:
+            robot._build()
+        if self.eng.terrain is not None:
+            self._stream_terrain()
+        self.curr_epoch += 1
+        return [robot._get_vector_state() for robot in self.robots]
+
+    # Takes one action per robot, returns lists of per-robot observations,
+    # rewards, dones and infos
+    def _step(self, actions):
+        self.eng.handle_events(self.robots[0].key_events, self)
+        for robot, action in zip(self.robots, actions):
+            self.eng.apply_controls(robot._get_controls(action), robot)
+        self.eng.finish_controls()
+        self.eng.step()
+        if self.eng.terrain is not None:
+            self._stream_terrain()
+
+        results = [robot._observe() for robot in self.robots]
+        observations, rewards, dones, infos = [list(result) for result in zip(*results)]
+        return observations, rewards, dones, infos
+
+    # Terrain around the whole field, from the last robot to the leader
+    def _stream_terrain(self):
+        xs = [self.eng.bodies[robot.prefix + 'body'].position[0] for robot in self.robots]
+        self.eng.terrain.stream(self.eng, min(xs), max(xs))
+
+    def _render(self, mode='human', close=False):
+        if not close:
+            eng = self.eng
+            self.distances = [
+                eng.get_render_position(robot.prefix + 'body')[0] + eng.origin_x - robot.offset[0]
+                for robot in self.robots
+            ]
+            leader = max(range(len(self.robots)), key=lambda k: self.distances[k])
+            self.eng.render(self.robots[leader].prefix + self.obj_to_follow, True, False, self.hud_layer)
+
+    def _draw_hud(self, eng):
+        self.hud.draw(eng, [
+            'robot %d x-distance: %s' % (k, self.hud.number(distance))
+            for k, distance in enumerate(self.distances)
+        ])
+
+    def _close(self):
+        if self.eng is not None:
+            self.eng.quit()
@@ -0,0 +1,190 @@
+'''
+
+This steps a batch of Uniped environments together, writing results into
+preallocated NumPy arrays
+
+'''
+
+import numpy as np
+from gym.utils import seeding
+
+import normalization
+import replay as replay_lib
+import uniped
+
+class VectorUniped():
+
+    # The environments
+    envs = None
+
+    # Preallocated results, overwritten on every reset/step
+    observations = None
+    rewards = None
+    dones = None
+    infos = None
+
+    # Draws the randomization of every env being reset in one batch
+    np_random = None
+
+    # Running observation/reward normalization applied to the arrays above
+    # (None = raw values, see normalization.py)
+    normalization = None
+
+    # Ring buffer every step's transitions are copied into, straight from
+    # the arrays above (None = off, see replay.py)
+    replay = None
+
+    # Observations and rewards as they were before normalization, which is
+    # what the replay buffer stores (the arrays above themselves if there
+    # is nothing to keep apart)
+    raw_observations = None
+    raw_rewards = None
+
+    def __init__(self, morphology, num_envs, normalize=None, replay=None, **env_kwargs):
+        env_kwargs.setdefault('render_window', False)
+        self.envs = [uniped.make(morphology, **env_kwargs) for _ in range(num_envs)]
+        self.seed()
+
+        obs_dim = len(self.envs[0]._get_vector_state())
+        self.observations = np.zeros((num_envs, obs_dim))
+        self.rewards = np.zeros(num_envs)
+        self.dones = np.zeros(num_envs, dtype=bool)
+        self.infos = [{} for _ in range(num_envs)]
+
+        self.normalization = normalization.make(normalize)
+        if self.normalization is not None:
+            self.normalization.setup(num_envs, obs_dim)
+
+        # One stream per env
+        self.replay = replay_lib.make(replay, obs_dim, num_envs)
+
+        if self.normalization is not None and self.replay is not None:
+            self.raw_observations = np.zeros_like(self.observations)
+            self.raw_rewards = np.zeros_like(self.rewards)
+        else:
+            self.raw_observations = self.observations
+            self.raw_rewards = self.rewards
+
+    def __len__(self):
+        return len(self.envs)
+
+    @property
+    def obs_dim(self):
+        return self.observations.shape[1]
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        seeds = [seed]
+        for env in self.envs:
+            seeds += env._seed(int(self.np_random.randint(2 ** 31)))
+        return seeds
+
+    def reset(self, indices=None):
+        if indices is None:
+            indices = range(len(self.envs))
+
+        # One draw for the whole batch instead of one per env
+        samples = [None] * len(indices)
+        randomization = self.envs[0].randomization
+        if randomization is not None and len(indices) > 0:
+            plan = self.envs[0].plan
+            batch = randomization.sample(
+                self.np_random, len(plan.bodies), len(plan.joints), len(indices)
+            )
+            samples = [randomization.unbatch(batch, k) for k in range(len(indices))]
+
+        for i, sample in zip(indices, samples):
+            self.observations[i] = self.envs[i]._reset(sample)
+            self.rewards[i] = 0
+            self.dones[i] = False
+
+        if self.normalization is not None:
+            self.keep_raw(indices)
+            self.normalization.reset_returns(indices)
+            self.normalize_observations(indices)
+        if self.replay is not None:
+            for i in indices:
+                self.replay.end_stream(i)
+        return self.observations
+
+    def step(self, actions, indices=None):
+        # actions[k] goes to env indices[k] (all envs if indices is None)
+        if indices is None:
+            indices = range(len(self.envs))
+        full = isinstance(indices, range) and len(indices) == len(self.envs)
+
+        # Observations the actions are taken from (the rest goes in once stepped)
+        if self.replay is not None:
+            ids = self.replay.reserve(self.raw_observations if full else self.raw_observations[list(indices)])
+
+        for i, action in zip(indices, actions):
+            observation, reward, done, info = self.envs[i]._step(action, reward=False)
+            self.observations[i] = observation
+            self.dones[i] = done
+            self.infos[i] = info
+
+        # Rewards of the whole batch in one NumPy pass (see rewards.py)
+        reward = self.envs[0].reward
+        if full:
+            reward.evaluate_batch(self.envs, self.rewards)
+        else:
+            self.rewards[list(indices)] = reward.evaluate_batch(
+                [self.envs[i] for i in indices], np.empty(len(indices))
+            )
+
+        # The episode summaries count the rewards too
+        for i in indices:
+            stats = self.envs[i].episode_stats
+            stats.add_reward(float(self.rewards[i]))
+            if self.dones[i]:
+                self.infos[i]['episode']['return'] = stats.total_reward
+
+        # After the summaries, which report raw returns
+        if self.normalization is not None:
+            self.keep_raw(indices)
+            self.normalize_observations(indices)
+            self.normalize_rewards(indices)
+
+        # Raw values, which samplers normalize with normalization.apply()
+        if self.replay is not None:
+            if full:
+                self.replay.commit(ids, indices, actions, self.raw_rewards, self.raw_observations, self.dones)
+            else:
+                rows = list(indices)
+                self.replay.commit(
+                    ids, rows, actions, self.raw_rewards[rows], self.raw_observations[rows], self.dones[rows]
+                )
+        return self.observations, self.rewards, self.dones, self.infos
+
+    # Copy the raw values of the envs at indices aside, if they are kept
+    def keep_raw(self, indices):
+        if self.raw_observations is self.observations:
+            return
+        if isinstance(indices, range) and len(indices) == len(self.envs):
+            np.copyto(self.raw_observations, self.observations)
+            np.copyto(self.raw_rewards, self.rewards)
+        elif len(indices) > 0:
+            rows = list(indices)
+            self.raw_observations[rows] = self.observations[rows]
+            self.raw_rewards[rows] = self.rewards[rows]
+
+    # In place on the whole arrays, or on the rows of indices
+    def normalize_observations(self, indices):
+        if isinstance(indices, range) and len(indices) == len(self.envs):
+            self.normalization.normalize_observations(self.observations)
+        elif len(indices) > 0:
+            rows = list(indices)
+            self.observations[rows] = self.normalization.normalize_observations(self.observations[rows])
+
+    def normalize_rewards(self, indices):
+        if isinstance(indices, range) and len(indices) == len(self.envs):
+            self.normalization.normalize_rewards(self.rewards, self.dones)
+        elif len(indices) > 0:
+            rows = list(indices)
+            self.rewards[rows] = self.normalization.normalize_rewards(
+                self.rewards[rows], self.dones[rows], rows
+            )
+
+    def close(self):
+        for env in self.envs:
+            env._close()
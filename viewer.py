@@ -0,0 +1,133 @@
+'''
+
+This shows a grid of Uniped environments in one window (or one offscreen
+frame) while they train: every tile is a scaled-down view of one env's world
+with its own camera following the env's obj_to_follow. Drawing is throttled
+to a fixed rate of wall-clock time, independent of how fast the envs step.
+
+    view = viewer.TiledViewer(vec_env, indices=range(8), columns=4)
+    while training:
+        vec_env.step(actions)
+        view.update()
+
+'''
+
+import time
+
+import engine
+
+# Sky, as in Engine.render
+BACKGROUND = (60, 120, 216)
+LABEL_COLOR = (230, 230, 230)
+BORDER_COLOR = (20, 20, 20)
+
+class TiledViewer():
+
+    # (env, index) per tile
+    tiles = None
+
+    # Layout
+    columns = 4
+    tile_width = 250
+    tile_height = 200
+    ppm = engine.PPM / 4 # pixels per meter within a tile
+    texture = False # grass texture on the ground (slow)
+    labels = True # env index and distance in the corner of each tile
+
+    # Throttling: at most fps frames per second of wall-clock time
+    fps = 10.0
+    last_draw = None
+
+    # Destination: a window, or an offscreen surface (see frame/array)
+    render_window = True
+    frame = None
+    font = None
+    closed = False
+
+    # envs: a VectorUniped or a list of Unipeds (robots of a MultiUniped
+    # work too); indices: which of them to show (all by default)
+    def __init__(self, envs, indices=None, columns=4, tile_size=(250, 200),
+                 ppm=engine.PPM / 4, fps=10.0, render_window=True, texture=False, labels=True):
+        envs = getattr(envs, 'envs', envs)
+        if indices is None:
+            indices = range(len(envs))
+        self.tiles = [(envs[i], i) for i in indices]
+        self.columns = max(1, min(columns, len(self.tiles)))
+        self.tile_width, self.tile_height = tile_size
+        self.ppm = ppm
+        self.fps = fps
+        self.render_window = render_window
+        self.texture = texture
+        self.labels = labels
+
+    def init_frame(self):
+        pygame = engine.load_pygame()
+        pygame.init()
+        rows = (len(self.tiles) + self.columns - 1) // self.columns
+        size = (self.columns * self.tile_width, rows * self.tile_height)
+        if self.render_window:
+            self.frame = pygame.display.set_mode(size)
+            pygame.display.set_caption('usim2.0 - %d envs' % len(self.tiles))
+        else:
+            self.frame = pygame.Surface(size)
+        if self.labels:
+            pygame.font.init()
+            self.font = pygame.font.SysFont('arial', 12)
+
+    # Call as often as convenient (e.g. after every step): draws only once
+    # 1/fps seconds have passed since the last frame. Returns whether it drew.
+    def update(self):
+        if self.closed:
+            return False
+        now = time.perf_counter()
+        if self.last_draw is not None and now - self.last_draw < 1.0 / self.fps:
+            return False
+        self.last_draw = now
+        self.draw()
+        return True
+
+    def draw(self):
+        if self.frame is None:
+            self.init_frame()
+        pygame = engine.pygame
+
+        for k, (env, index) in enumerate(self.tiles):
+            x = (k % self.columns) * self.tile_width
+            y = (k // self.columns) * self.tile_height
+            tile = self.frame.subsurface((x, y, self.tile_width, self.tile_height))
+            self.draw_tile(env, index, tile)
+            pygame.draw.rect(self.frame, BORDER_COLOR, (x, y, self.tile_width, self.tile_height), 1)
+
+        if self.render_window:
+            pygame.display.flip()
+            # Keep the window responsive; closing it only stops the viewer
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.close()
+
+    def draw_tile(self, env, index, tile):
+        tile.fill(BACKGROUND)
+        eng = env.eng
+        camera_x, camera_y = 0, 0
+        body = eng.bodies.get(env.prefix + (env.obj_to_follow or 'body'))
+        if body is not None:
+            position = body.position
+            camera_x = position[0] * self.ppm - 0.5 * self.tile_width
+            camera_y = 0.5 * self.tile_height - position[1] * self.ppm
+        eng.draw_world(tile, camera_x, camera_y, self.ppm, self.texture)
+
+        if self.labels:
+            text = '%d: %.1fm' % (index, env.episode_stats.summary(env)['distance'])
+            tile.blit(self.font.render(text, True, LABEL_COLOR), (4, 2))
+
+    # Last frame as an (height, width, 3) uint8 array, e.g. for logging
+    def array(self):
+        if self.frame is None:
+            self.draw()
+        return engine.pygame.surfarray.array3d(self.frame).transpose(1, 0, 2)
+
+    def close(self):
+        if self.frame is not None and self.render_window:
+            engine.pygame.display.quit()
+        self.frame = None
+        self.closed = True